@@ -0,0 +1,432 @@
+import bisect
+import gzip
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: в журнал пишет только один процесс
+    fcntl = None
+
+
+class SegmentedLog:
+    """Журнал только на дозапись: JSON-строки в файлах-сегментах.
+
+    Запись — одна строка в конец текущего сегмента, без перечитывания
+    старых данных. Сегмент закрывается по размеру или возрасту,
+    имя файла — порядковый номер и время открытия.
+
+    Записи идут по возрастанию поля key (времени), поэтому для выборок
+    по интервалу хватает разреженного индекса: для каждого сегмента —
+    первое и последнее значение и смещение каждой INDEX_EVERY-й строки.
+
+    Писать в журнал могут несколько процессов: дозапись и смена сегмента
+    идут под файловой блокировкой, а индекс догоняет файл по его размеру.
+    Открыв новый сегмент, процесс переписывает файл current, и остальные
+    замечают смену по его stat, не перечитывая папку на каждую запись.
+
+    Старые закрытые сегменты archive() переносит в помесячные архивы
+    archive/YYYY-MM.jsonl.gz; query() читает их потоково вместе с живыми."""
+
+    BLOCK_SIZE = 8192
+    INDEX_EVERY = 256
+
+    def __init__(self, directory: str, max_segment_bytes: int, max_segment_age: float,
+                 key: str = 'timestamp'):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.key = key
+        self._lock = threading.Lock()
+        self._file = None
+        # имя сегмента -> индекс; строится при первой выборке и дополняется при записи
+        self._index = {}
+        self.archive_directory = os.path.join(directory, 'archive')
+        os.makedirs(self.archive_directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, '.lock'), 'a')
+        self._current_path = os.path.join(directory, 'current')
+        self._current_stamp = self._stat_current()
+        self._segments = self._list_segments()
+
+    def _list_segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.jsonl'))
+
+    def _stat_current(self):
+        try:
+            stat = os.stat(self._current_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _publish_current(self, name: str):
+        """Сообщает другим процессам об открытии нового сегмента"""
+        tmp_path = self._current_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(name)
+        os.replace(tmp_path, self._current_path)
+        self._current_stamp = self._stat_current()
+
+    @contextmanager
+    def _process_lock(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _parse_name(name: str):
+        seq, started = name[:-len('.jsonl')].split('_')
+        return int(seq), int(started)
+
+    def segment_paths(self):
+        with self._lock:
+            self._segments = self._list_segments()
+            return [os.path.join(self.directory, name) for name in self._segments]
+
+    def _open_segment(self):
+        if self._segments:
+            seq, started = self._parse_name(self._segments[-1])
+            path = os.path.join(self.directory, self._segments[-1])
+            if (os.path.getsize(path) < self.max_segment_bytes
+                    and time.time() - started < self.max_segment_age):
+                self._file = open(path, 'ab')
+                return
+            seq += 1
+        else:
+            seq = 1
+        name = f'{seq:08d}_{int(time.time())}.jsonl'
+        self._segments.append(name)
+        self._file = open(os.path.join(self.directory, name), 'ab')
+        self._publish_current(name)
+
+    def _rotate_if_needed(self):
+        _, started = self._parse_name(self._segments[-1])
+        if (os.fstat(self._file.fileno()).st_size >= self.max_segment_bytes
+                or time.time() - started >= self.max_segment_age):
+            self._file.close()
+            self._file = None
+            self._open_segment()
+
+    def append(self, entry: dict):
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        if not entries:
+            return
+        with self._lock, self._process_lock():
+            self._append_locked(entries)
+
+    def _sync_segments(self):
+        # Новый сегмент мог открыть другой процесс — тогда он переписал current
+        stamp = self._stat_current()
+        if stamp != self._current_stamp or not self._segments:
+            self._current_stamp = stamp
+            self._segments = self._list_segments()
+            if self._file is not None and (
+                    not self._segments or os.path.basename(self._file.name) != self._segments[-1]):
+                self._file.close()
+                self._file = None
+
+    def _append_locked(self, entries):
+        lines = [json.dumps(e, ensure_ascii=False).encode('utf-8') + b'\n' for e in entries]
+        self._sync_segments()
+        if self._file is None:
+            self._open_segment()
+        else:
+            self._rotate_if_needed()
+        offset = os.fstat(self._file.fileno()).st_size
+        index = self._index.get(self._segments[-1])
+        # Индекс дополняем, только если он доходит до конца файла,
+        # иначе его догонит _segment_index
+        if index is not None and index['size'] == offset:
+            for entry, line in zip(entries, lines):
+                self._index_entry(index, entry[self.key], offset)
+                offset += len(line)
+            index['size'] = offset
+        self._file.write(b''.join(lines))
+        self._file.flush()
+
+    def merge(self, entries) -> int:
+        """Вливает записи со стороны (перенос старой таблицы), пропуская те,
+        что уже есть в хвосте журнала, и возвращает число добавленных.
+
+        Проверка и запись идут под блокировками журнала, поэтому процессы,
+        запущенные одновременно, не перенесут одни и те же записи дважды.
+        Записи новее журнала дописываются в конец, более старые вливаются
+        по порядку в копию текущего сегмента, которая его заменяет"""
+        entries = sorted(entries, key=lambda e: e[self.key])
+        if not entries:
+            return 0
+        with self._lock, self._process_lock():
+            self._sync_segments()
+            # Хвост журнала от самой старой вливаемой записи, читаем сегменты с конца
+            tail, current = [], None
+            for name in reversed(self._segments):
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    segment = [json.loads(line) for line in f if line.endswith(b'\n') and line.strip()]
+                if current is None:
+                    current = (name, segment)
+                tail = segment + tail
+                if segment and segment[0][self.key] < entries[0][self.key]:
+                    break
+
+            existing = Counter(self._entry_key(entry) for entry in tail)
+            missing = []
+            for entry in entries:
+                key = self._entry_key(entry)
+                if existing[key]:
+                    existing[key] -= 1
+                else:
+                    missing.append(entry)
+            if not missing:
+                return 0
+
+            if not tail or missing[0][self.key] >= tail[-1][self.key]:
+                self._append_locked(missing)
+            else:
+                self._replace_current(current, missing)
+        return len(missing)
+
+    @staticmethod
+    def _entry_key(entry: dict):
+        return json.dumps(entry, ensure_ascii=False, sort_keys=True)
+
+    def _replace_current(self, current, entries):
+        """Пишет текущий сегмент вместе с entries по порядку в новый сегмент
+        и удаляет старый; остальные процессы переключатся на него по current"""
+        name, segment = current
+        merged = sorted(segment + list(entries), key=lambda e: e[self.key])
+        seq, started = self._parse_name(name)
+        new_name = f'{seq + 1:08d}_{started}.jsonl'
+        tmp_path = os.path.join(self.directory, new_name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            for entry in merged:
+                f.write(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, new_name))
+        os.remove(os.path.join(self.directory, name))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._index.pop(name, None)
+        self._segments = self._list_segments()
+        self._publish_current(new_name)
+
+    def _index_entry(self, index: dict, value, offset: int):
+        if index['count'] % self.INDEX_EVERY == 0:
+            index['marks'].append((value, offset))
+        if index['first'] is None:
+            index['first'] = value
+        index['last'] = value
+        index['count'] += 1
+
+    def _segment_index(self, name: str):
+        with self._lock:
+            return self._build_index(name)
+
+    def _build_index(self, name: str):
+        index = self._index.get(name)
+        if index is None:
+            index = self._index[name] = {'first': None, 'last': None, 'count': 0, 'marks': [], 'size': 0}
+        path = os.path.join(self.directory, name)
+        if os.path.getsize(path) > index['size']:
+            # Дочитываем строки, дописанные после последней индексации
+            offset = index['size']
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # недописанная строка
+                    if line.strip():
+                        self._index_entry(index, json.loads(line)[self.key], offset)
+                    offset += len(line)
+            index['size'] = offset
+        return index
+
+    def query(self, start, end):
+        """Записи с start <= key <= end по порядку, не читая лишних сегментов"""
+        names = [os.path.basename(path) for path in self.segment_paths()]
+        if names:
+            index = self._segment_index(names[0])
+            if not index['count'] or start < index['first']:
+                yield from self.query_archive(start, end)
+        else:
+            yield from self.query_archive(start, end)
+        for name in names:
+            try:
+                index = self._segment_index(name)
+            except FileNotFoundError:
+                continue  # сегмент только что ушёл в архив и уже прочитан из него
+            if not index['count'] or index['last'] < start:
+                continue
+            if index['first'] > end:
+                return
+            # Начинаем с последней отметки раньше start
+            keys = [mark[0] for mark in index['marks']]
+            position = max(bisect.bisect_left(keys, start) - 1, 0)
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                f.seek(index['marks'][position][1])
+                for line in f:
+                    # Недописанную строку в активном сегменте пропускаем
+                    if not line.endswith(b'\n') or not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry[self.key] < start:
+                        continue
+                    if entry[self.key] > end:
+                        return
+                    yield entry
+
+    def archive_paths(self):
+        return [
+            os.path.join(self.archive_directory, name)
+            for name in sorted(os.listdir(self.archive_directory)) if name.endswith('.jsonl.gz')
+        ]
+
+    def query_archive(self, start, end):
+        """Записи из архивов за нужные месяцы, распаковка идёт потоково"""
+        for path in self.archive_paths():
+            month = os.path.basename(path)[:7]
+            if month < start[:7] or month > end[:7]:
+                continue
+            with gzip.open(path, 'rb') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry[self.key] < start:
+                        continue
+                    if entry[self.key] > end:
+                        break
+                    yield entry
+
+    def archive(self, before) -> int:
+        """Переносит закрытые сегменты, все записи которых старше before,
+        в помесячные архивы и возвращает число перенесённых записей.
+
+        Архив месяца пересобирается во временный файл и подменяется
+        атомарно, и только потом удаляются сегменты. Если процесс упадёт
+        между этими шагами, при следующем запуске уже перенесённые записи
+        (не новее последней записи архива) не продублируются."""
+        with self._lock, self._process_lock():
+            self._segments = self._list_segments()
+            names = []
+            # Только старейшие сегменты подряд и никогда — текущий
+            for name in self._segments[:-1]:
+                index = self._build_index(name)
+                if index['count'] and index['last'] >= before:
+                    break
+                names.append(name)
+        if not names:
+            return 0
+
+        writers, last_keys, moved = {}, {}, 0
+        try:
+            for name in names:
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        key = json.loads(line)[self.key]
+                        month = key[:7]
+                        if month not in writers:
+                            writers[month], last_keys[month] = self._open_archive(month)
+                        if last_keys[month] is not None and key <= last_keys[month]:
+                            continue
+                        writers[month].write(line if line.endswith(b'\n') else line + b'\n')
+                        moved += 1
+        except BaseException:
+            for writer in writers.values():
+                writer.close()
+                os.remove(writer.name)
+            raise
+
+        for month, writer in writers.items():
+            writer.close()
+            with open(writer.name, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(writer.name, self._archive_path(month))
+
+        with self._lock, self._process_lock():
+            for name in names:
+                os.remove(os.path.join(self.directory, name))
+                self._index.pop(name, None)
+            self._segments = self._list_segments()
+        return moved
+
+    def _archive_path(self, month: str) -> str:
+        return os.path.join(self.archive_directory, f'{month}.jsonl.gz')
+
+    def _open_archive(self, month: str):
+        """Временный архив месяца с уже перенесёнными записями и последний ключ в нём"""
+        path = self._archive_path(month)
+        writer = gzip.open(f'{path}.tmp', 'wb')
+        last = None
+        if os.path.exists(path):
+            with gzip.open(path, 'rb') as f:
+                for line in f:
+                    writer.write(line)
+                    last = json.loads(line)[self.key]
+        return writer, last
+
+    def tail(self, count: int):
+        """Последние count записей (от старых к новым), читая файлы с конца"""
+        entries = []
+        for path in reversed(self.segment_paths()):
+            try:
+                lines = self._read_last_lines(path, count - len(entries))
+            except FileNotFoundError:
+                break  # дальше только сегменты, ушедшие в архив
+            entries = [json.loads(line) for line in lines] + entries
+            if len(entries) >= count:
+                break
+        return entries
+
+    def _read_last_lines(self, path: str, count: int):
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            buffer = b''
+            # Читаем блоками с конца, пока не наберём count полных строк
+            while position > 0 and buffer.count(b'\n') <= count:
+                step = min(self.BLOCK_SIZE, position)
+                position -= step
+                f.seek(position)
+                buffer = f.read(step) + buffer
+        lines = buffer.split(b'\n')
+        if position > 0:
+            lines = lines[1:]  # первая строка блока может быть обрезана
+        lines = [line for line in lines if line.strip()]
+        return lines[-count:] if count > 0 else []
+
+    def __iter__(self):
+        """Все записи по порядку, включая архивы, без загрузки журнала в память"""
+        for path in self.archive_paths():
+            with gzip.open(path, 'rb') as f:
+                for line in f:
+                    yield json.loads(line)
+        for path in self.segment_paths():
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def is_empty(self) -> bool:
+        return not any(os.path.getsize(path) for path in self.segment_paths())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,1078 @@
+import os
+import re
+import html
+import io
+import itertools
+import tempfile
+import asyncio
+import logging
+from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.enums import ParseMode
+from aiogram.filters import Command, StateFilter
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.exceptions import TelegramBadRequest
+from datetime import datetime
+
+import database as db
+import metrics
+import name_index
+import pass_token
+import qr_decoder
+from repository import Repository
+from broadcast import Broadcaster
+from pending import PendingRegistry
+from scheduler import GuestExpiryScheduler
+from compaction import Compactor
+from fsm_storage import SQLiteFSMStorage
+from webhook import WebhookServer
+from digest import ApprovalDigest
+from throttling import ThrottlingMiddleware, TokenBuckets, parse_limits
+from workers import ProcessWorkers, UpdateWorkers, run_polling
+from dotenv import load_dotenv
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+bot = Bot(
+    token=os.getenv("BOT_TOKEN"),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+)
+# Состояния регистрации и публикации новостей переживают перезапуск
+storage = SQLiteFSMStorage(
+    os.getenv("FSM_PATH", "fsm.sqlite3"),
+    cache_size=int(os.getenv("FSM_CACHE_SIZE", "10000")),
+    cache_ttl=float(os.getenv("FSM_CACHE_TTL", "600")),
+    session_ttl=float(os.getenv("FSM_SESSION_DAYS", "7")) * 24 * 3600
+)
+dp = Dispatcher(storage=storage)
+# Ограничение частоты ставим раньше FSM, чтобы отброшенные команды не читали состояние
+throttling = ThrottlingMiddleware(TokenBuckets(
+    parse_limits(os.getenv("THROTTLE_LIMITS", "scan_pass=5/60,reg=3/60")),
+    max_size=int(os.getenv("THROTTLE_MAX_USERS", "100000"))
+))
+dp.update.outer_middleware.unregister(dp.fsm)
+dp.update.outer_middleware(throttling)
+dp.update.outer_middleware(dp.fsm)
+dp.update.outer_middleware(metrics.UpdateMetricsMiddleware())
+dp.message.middleware(metrics.HandlerMetricsMiddleware())
+dp.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+# Номер процесса-воркера при BOT_WORKERS > 1 (задаёт workers.ProcessWorkers)
+WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", "0"))
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+metrics_server = metrics.MetricsServer(
+    host=os.getenv("METRICS_HOST", "127.0.0.1"),
+    port=metrics_port + WORKER_INDEX if metrics_port else 0
+)
+repo = Repository(
+    qr_workers=int(os.getenv("QR_WORKERS", "2")),
+    bulk_workers=int(os.getenv("QR_BULK_WORKERS", "0")) or None
+)
+decoder = qr_decoder.QRDecoder(
+    workers=int(os.getenv("QR_DECODE_WORKERS", "2")),
+    queue_size=int(os.getenv("QR_DECODE_QUEUE", "20")),
+    max_side=int(os.getenv("QR_DECODE_MAX_SIDE", "800")),
+    timeout=float(os.getenv("QR_DECODE_TIMEOUT", "2"))
+)
+broadcaster = Broadcaster(
+    bot, repo,
+    rate=float(os.getenv("BROADCAST_RATE", "25")),
+    concurrency=int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+)
+
+async def on_request_expired(request):
+    # Истёкший запрос просто исчезает из сводки
+    if request.get('admin_message_id'):
+        await digest.refresh(request['admin_message_id'])
+    try:
+        await bot.send_message(
+            chat_id=request['requester_id'],
+            text="⌛️ Администратор не ответил на запрос. Отсканируйте пропуск ещё раз"
+        )
+    except Exception as e:
+        logging.error(f"Ошибка отправки пользователю: {e}")
+
+pending = PendingRegistry(
+    repo,
+    ttl=float(os.getenv("PENDING_TTL", "600")),
+    on_expire=on_request_expired
+)
+guest_expiry = GuestExpiryScheduler(repo, pending)
+compactor = Compactor(
+    repo,
+    interval=float(os.getenv("COMPACT_INTERVAL_HOURS", "24")) * 3600,
+    log_retention_days=float(os.getenv("ACCESS_LOG_RETENTION_DAYS", "90")),
+    guest_retention_days=float(os.getenv("GUEST_RETENTION_DAYS", "30"))
+)
+digest = ApprovalDigest(
+    bot, repo, pending,
+    chat_id=os.getenv("ADMIN_CHAT_ID"),
+    window=float(os.getenv("DIGEST_WINDOW", "3")),
+    max_items=int(os.getenv("DIGEST_MAX_ITEMS", "20"))
+)
+
+def is_admin(user_id: int) -> bool:
+    admin_ids = list(map(int, os.getenv("ADMIN_IDS").split(',')))
+    return user_id in admin_ids
+
+async def answer_qr(message: types.Message, record, update_record, caption: str,
+                    as_document: bool = False, png: bytes = None):
+    """Отправляет QR-код по сохранённому file_id, а PNG загружает только
+    при первой отправке или если Telegram отклонил старый file_id"""
+    send = message.answer_document if as_document else message.answer_photo
+    field = 'qr_document_file_id' if as_document else 'qr_file_id'
+
+    if record.get(field):
+        try:
+            return await send(record[field], caption=caption)
+        except TelegramBadRequest as e:
+            logging.warning(f"file_id QR-кода отклонён, загружаем заново: {e}")
+
+    if png is None:
+        png = await repo.get_qr_png(record)
+    sent = await send(types.BufferedInputFile(png, filename=f"qr_{record['qr_id']}.png"), caption=caption)
+    file_id = sent.document.file_id if as_document else sent.photo[-1].file_id
+    await update_record(record.doc_id, {field: file_id})
+    return sent
+
+
+# Обработчик команды /start
+@dp.message(Command('start'))
+async def send_hello(message: types.Message):
+    await message.answer("Привет, что бы зарегистрироваться напиши команду /reg а если у тебя есть временный пропуск то напиши команду /scan_pass номер кода")
+
+#Обработчик команды /reg
+class RegistrationState(StatesGroup):
+    full_name = State()
+    vehicle = State()
+
+@dp.message(Command('reg'))
+async def start_registration(message: types.Message, state: FSMContext):
+    if is_admin(message.from_user.id):
+        return await message.answer("👑 Вы авторизованы как администратор")
+    
+    user = await repo.get_user(message.from_user.id)
+    if user:
+        return await message.answer("✅ Вы уже зарегистрированы")
+    
+    await state.set_state(RegistrationState.full_name)
+    await message.answer("""🔐 Регистрация:
+Введите ваше ФИО в формате: Иванов Иван Иванович""")
+
+@dp.message(RegistrationState.full_name)
+async def process_full_name(message: types.Message, state: FSMContext):
+    if len(message.text.split()) < 3:
+        return await message.answer("❌ Введите полное ФИО")
+    
+    await state.update_data(full_name=message.text)
+    await state.set_state(RegistrationState.vehicle)
+    await message.answer("🚗 Введите номер транспортного средства (или 'нет'):")
+
+@dp.message(RegistrationState.vehicle)
+async def process_vehicle(message: types.Message, state: FSMContext):
+    vehicle = message.text if message.text.lower() != 'нет' else None
+    data = await state.get_data()
+    
+    if await repo.create_user(message.from_user.id, data['full_name'], vehicle):
+        await message.answer("✅ Регистрация завершена!")
+    else:
+        await message.answer("⚠️ Вы уже зарегистрированы")
+    
+    await state.clear()
+
+# Команда для пользователей
+@dp.message(Command('my_qrcode'))
+async def show_my_qrcode(message: types.Message):
+    user = await repo.get_user(message.from_user.id)
+    if not user:
+        return await message.answer("❌ Сначала пройдите регистрацию через /start")
+    
+    if not user.get('qr_payload') and not user.get('qr_code_path'):
+        return await message.answer("🔄 QR-код ещё не сгенерирован администратором")
+    
+    text = f"""
+🔑 Ваш пропуск:
+ФИО: {user['full_name']}
+Номер ТС: {user['vehicle'] or 'Нет'}
+ID: {user['qr_id']}
+    """
+    await answer_qr(message, user, repo.update_user, caption=text)
+
+# Сколько совпадений показывать в /find и подсказках /generate_user_qr
+FIND_LIMIT = int(os.getenv("FIND_LIMIT", "8"))
+
+# Админская команда для генерации QR
+@dp.message(Command('generate_user_qr'))
+async def generate_user_qr(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    
+    try:
+        full_name = message.text.split(maxsplit=1)[1]
+    except IndexError:
+        return await message.answer("❌ Формат: /generate_user_qr <ФИО>")
+    
+    user = await repo.find_user_by_name(full_name)
+    if not user:
+        # Точного совпадения нет: ФИО, отличающееся только регистром или ё/е,
+        # берём сразу, иначе предлагаем похожие кнопками
+        matches = await repo.search_users(full_name, FIND_LIMIT)
+        exact = [u for u, _ in matches if name_index.normalize(u['full_name']) == name_index.normalize(full_name)]
+        if len(exact) == 1:
+            user = exact[0]
+        elif matches:
+            return await message.answer(
+                "❓ Точного совпадения нет. Возможно, вы имели в виду:",
+                reply_markup=find_keyboard(matches, [])
+            )
+        else:
+            return await message.answer("❌ Пользователь не найден")
+    
+    await send_user_qr(message, user['user_id'])
+
+async def send_user_qr(message: types.Message, user_id: int):
+    user, png = await repo.generate_user_qr(user_id)
+    if user:
+        await answer_qr(
+            message,
+            user,
+            repo.update_user,
+            caption=f"✅ QR-код для {html.escape(user['full_name'])} сгенерирован",
+            as_document=True,
+            png=png
+        )
+    else:
+        await message.answer("❌ Ошибка генерации")
+
+def find_keyboard(users: list, employees: list) -> InlineKeyboardMarkup:
+    """Кнопка на каждое совпадение: QR для пользователя, блокировка для сотрудника"""
+    rows = [
+        [InlineKeyboardButton(text=f"🖨 {user['full_name']}", callback_data=f"find_qr_{user['user_id']}")]
+        for user, _ in users
+    ]
+    rows += [
+        [InlineKeyboardButton(
+            text=f"{'⛔' if employee['is_active'] else '✅'} {employee['full_name']}",
+            callback_data=f"find_employee_{employee.doc_id}"
+        )]
+        for employee, _ in employees
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+@dp.message(Command('find'))
+async def find_people(message: types.Message):
+    """Поиск пользователей и сотрудников по ФИО с опечатками"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+
+    try:
+        query = message.text.split(maxsplit=1)[1]
+    except IndexError:
+        return await message.answer("❌ Формат: /find <ФИО или его часть>")
+
+    users = await repo.search_users(query, FIND_LIMIT)
+    employees = await repo.search_employees(query, FIND_LIMIT)
+    if not users and not employees:
+        return await message.answer("❌ Никого не найдено")
+
+    ranked = sorted(
+        [(score, f"👤 {html.escape(user['full_name'])} — QR-ID {user['qr_id']}") for user, score in users] +
+        [(score, f"💼 {html.escape(employee['full_name'])} — {html.escape(employee['position'])}"
+                 f"{'' if employee['is_active'] else ' (заблокирован)'}") for employee, score in employees],
+        key=lambda item: item[0], reverse=True
+    )[:FIND_LIMIT]
+    text = f"🔎 Найдено по «{html.escape(query)}»:\n\n" + "\n".join(
+        f"{i}. {line} ({score:.0%})" for i, (score, line) in enumerate(ranked, 1)
+    )
+    await message.answer(text, reply_markup=find_keyboard(users, employees))
+
+@dp.callback_query(F.data.startswith("find_"))
+async def handle_find_action(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return await callback.answer("🚫 Доступ запрещен")
+
+    _, action, record_id = callback.data.split('_')
+    if action == 'qr':
+        await send_user_qr(callback.message, int(record_id))
+        return await callback.answer()
+
+    employee = await repo.get_employee(int(record_id))
+    if not employee:
+        return await callback.answer("⚠️ Сотрудник не найден")
+    await repo.toggle_employee_status(employee.doc_id)
+    await callback.answer(f"{employee['full_name']}: {'заблокирован' if employee['is_active'] else 'разблокирован'}")
+
+@dp.message(Command('bulk_qr'))
+async def bulk_generate_qr(message: types.Message):
+    """Массовый выпуск QR: всем без пропуска или по списку ФИО (через ; или с новой строки)"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    
+    args = message.text.split(maxsplit=1)
+    missing = []
+    if len(args) == 1 or args[1].strip().lower() in ('all', 'все'):
+        users = await repo.get_users_without_qr()
+    else:
+        names = [name.strip() for name in re.split(r'[;\n]', args[1]) if name.strip()]
+        users, missing = await repo.find_users_by_names(names)
+    
+    if not users:
+        return await message.answer("📂 Нет пользователей для выпуска QR-кодов")
+    
+    await message.answer(f"⏳ Выпускаю QR-коды: {len(users)} шт.")
+    archives, summary = await repo.bulk_generate_user_qr(users, missing)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M')
+    # ФИО в сводке вводят администраторы — экранируем перед HTML-разметкой
+    caption = f"✅ {html.escape(summary[:1000])}"
+    for number, archive in enumerate(archives, 1):
+        filename = f"qrcodes_{stamp}.zip" if len(archives) == 1 else f"qrcodes_{stamp}_{number}.zip"
+        await message.answer_document(
+            types.BufferedInputFile(archive, filename=filename),
+            caption=caption if number == 1 else f"📦 Архив {number} из {len(archives)}"
+        )
+
+# Пропуска с голым числовым qr_id (старые QR-коды) можно запретить, когда все перевыпущены
+ACCEPT_PLAIN_QR_IDS = os.getenv("QR_ACCEPT_PLAIN_IDS", "1") == "1"
+# Как часто подхватывать блокировки из других процессов, секунд
+REVOCATION_SYNC = float(os.getenv("QR_REVOCATION_SYNC", "5"))
+
+PASS_ERRORS = {
+    'expired': "⌛️ Срок действия пропуска истек",
+    'revoked': "🔒 Пропуск заблокирован",
+}
+
+
+async def request_access(message: types.Message, pass_id: int, user_type: str, summary: str):
+    """Создаёт запрос на проход и ставит его в сводку для администратора"""
+    request, created = await pending.open(
+        requester_id=message.from_user.id,
+        pass_id=pass_id,
+        user_type=user_type,
+        summary=summary
+    )
+    if not created:
+        return await message.answer("⏳ Запрос уже отправлен администратору, ожидайте ответа")
+
+    # Запрос попадёт в ближайшую сводку для администратора
+    digest.add(request)
+    return await message.answer("⏳ Запрос отправлен администратору")
+
+
+async def scan_signed_pass(message: types.Message, payload: str):
+    """Подписанный QR: подпись, срок и блокировка проверяются без запросов к БД"""
+    await repo.sync_revocations(REVOCATION_SYNC)
+    try:
+        kind, qr_id, expires = pass_token.verify(payload)
+    except pass_token.InvalidPass as e:
+        return await message.answer(
+            PASS_ERRORS.get(e.reason, "❌ Недействительный QR-код. Обратитесь к администратору")
+        )
+
+    if kind == pass_token.GUEST:
+        until = datetime.fromtimestamp(expires).strftime('%Y-%m-%d')
+        return await request_access(message, qr_id, 'guest', f"🎫 Гость, QR-ID {qr_id}, до {until}")
+
+    # Пропуск пользователя годится только его владельцу
+    user = await repo.get_user(message.from_user.id)
+    if not user or user['qr_id'] != qr_id:
+        return await message.answer("🚫 Это не ваш QR-код!")
+    return await request_access(message, qr_id, 'user', f"👤 {html.escape(user['full_name'])}, QR-ID {qr_id}")
+
+
+@dp.message(Command('scan_pass'))
+async def handle_scan(message: types.Message):
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        return await message.answer("❌ Неверный формат. Используйте: /scan_pass <QR-код>")
+    return await scan_code(message, parts[1])
+
+
+async def scan_code(message: types.Message, code: str):
+    """Проверка пропуска по коду из команды или с фотографии"""
+    if pass_token.is_signed(code):
+        return await scan_signed_pass(message, code)
+    try:
+        scanned_qr_id = int(code)
+    except ValueError:
+        return await message.answer("❌ Неверный формат. Используйте: /scan_pass <QR-код>")
+    if not ACCEPT_PLAIN_QR_IDS:
+        return await message.answer("❌ Недействительный QR-код. Обратитесь к администратору")
+
+    # Проверка гостевого пропуска (для НЕзарегистрированных)
+    guest = await repo.get_guest_by_qr(scanned_qr_id)
+    if guest:
+        # Проверка срока действия и активности (истёкшие пропуска тоже отключаются)
+        if datetime.fromisoformat(guest['expires_at']) < datetime.now():
+            return await message.answer("⌛️ Срок действия гостевого пропуска истек")
+        if not guest['is_active']:
+            return await message.answer("🔒 Гостевой пропуск заблокирован")
+
+        return await request_access(
+            message, scanned_qr_id, 'guest',
+            f"🎫 Гость, QR-ID {scanned_qr_id}, до {guest['expires_at'][:10]}"
+        )
+
+    # Проверка для зарегистрированных пользователей
+    user = await repo.get_user(message.from_user.id)
+    if user:
+        # Проверка принадлежности QR-кода
+        if user['qr_id'] != scanned_qr_id:
+            return await message.answer("🚫 Это не ваш QR-код!")
+        if not user.get('is_active', True):
+            return await message.answer("🔒 Ваш аккаунт заблокирован")
+
+        return await request_access(
+            message, scanned_qr_id, 'user',
+            f"👤 {html.escape(user['full_name'])}, QR-ID {scanned_qr_id}"
+        )
+
+    # Если QR-код не гостевой и пользователь не зарегистрирован
+    return await message.answer("❌ Недействительный QR-код. Обратитесь к администратору")
+
+@dp.message(StateFilter(None), F.photo, F.chat.type == 'private')
+async def handle_scan_photo(message: types.Message):
+    """Фото пропуска вместо ввода номера: QR распознаётся в пуле процессов"""
+    # Лимит /scan_pass — здесь, а не в middleware: сканом считаются только фото,
+    # дошедшие до этого обработчика
+    if not await throttling.allow(message, 'scan_pass'):
+        return
+    if not qr_decoder.available():
+        return await message.answer("📷 Распознавание фото недоступно, введите код: /scan_pass <QR-код>")
+    if decoder.busy():
+        return await message.answer("⏳ Слишком много фото в обработке, попробуйте через минуту")
+
+    # Хватает наименьшего размера, который не меньше max_side: меньше скачивать и уменьшать
+    photo = next(
+        (size for size in message.photo if max(size.width, size.height) >= decoder.max_side),
+        message.photo[-1]
+    )
+    buffer = await message.bot.download(photo, destination=io.BytesIO())
+    text = await decoder.decode(buffer.getvalue())
+    code = qr_decoder.pass_code(text) if text else None
+    if code is None:
+        return await message.answer("❌ QR-код на фото не найден. Снимите пропуск ближе или введите код вручную")
+    return await scan_code(message, code)
+
+async def apply_decisions(requests: list, action: str) -> str:
+    """Решение администратора по уже закрытым запросам: гостям при отказе
+    блокируется пропуск, всем уходит ответ, журнал пишется одной пачкой"""
+    status = "разрешён" if action == "allow" else "отклонён"
+    answer = (
+        "✅ Доступ подтвержден! Можете проходить." if action == "allow"
+        else "❌ Пропуск отклонен. Обратитесь к администратору."
+    )
+    entries, blocked, recipients = [], {}, []
+    for request in requests:
+        if request['user_type'] == 'guest':
+            guest = await repo.get_guest_by_qr(request['pass_id'])
+            if not guest:
+                continue
+            if action == "deny":
+                blocked[guest.doc_id] = {'is_active': False}  # Блокируем ТОЛЬКО гостей
+            entries.append(('guest', request['pass_id'], status))
+        elif request['user_type'] == 'user':
+            if not await repo.get_user(request['requester_id']):
+                continue
+            entries.append(('user', request['requester_id'], status))
+        else:
+            continue
+        if request['requester_id']:
+            recipients.append(request['requester_id'])
+
+    if blocked:
+        await repo.update_guests(blocked)
+    if entries:
+        await repo.log_access_many(entries)
+    results = await asyncio.gather(
+        *(bot.send_message(chat_id=chat_id, text=answer) for chat_id in recipients),
+        return_exceptions=True
+    )
+    for chat_id, result in zip(recipients, results):
+        if isinstance(result, Exception):
+            logging.error(f"Ошибка отправки пользователю {chat_id}: {result}")
+    return status
+
+@dp.callback_query(F.data.startswith("access_"))
+async def handle_access_decision(callback: types.CallbackQuery):
+    # access_<action>_<pass_id>_<id запроса>; у старых кнопок id запроса нет
+    parts = callback.data.split('_')[1:]
+    action, pass_id = parts[0], int(parts[1])
+    
+    if len(parts) > 2:
+        request_id = int(parts[2])
+    else:
+        requests = await pending.fetch_by_pass_id(pass_id)
+        request_id = requests[0].doc_id if requests else None
+
+    # Снимаем запрос сразу: close отдаёт его только один раз, даже при двойном
+    # нажатии или если запрос открыт в другом процессе-воркере
+    request = await pending.close(request_id) if request_id is not None else None
+    if not request:
+        await callback.answer("⚠️ Запрос устарел")
+        return
+
+    status = await apply_decisions([request], action)
+    await digest.refresh(callback.message.message_id)
+    await callback.answer(f"Проход {status}")
+
+@dp.callback_query(F.data.startswith("digest_"))
+async def handle_digest_decision(callback: types.CallbackQuery):
+    """«Подтвердить все» / «Отклонить все» для сводки"""
+    _, action, *version = callback.data.split('_')
+    requests = await repo.find_pending_by_message(callback.message.message_id)
+    if version != [ApprovalDigest.fingerprint(requests)]:
+        # В сводку дописали запросы, которых администратор ещё не видел
+        await digest.refresh(callback.message.message_id)
+        return await callback.answer("⚠️ Сводка обновилась, проверьте запросы и нажмите ещё раз", show_alert=True)
+    closed = await pending.close_many([request.doc_id for request in requests])
+    if closed:
+        await apply_decisions(closed, action)
+    await digest.refresh(callback.message.message_id)
+    await callback.answer(f"Обработано запросов: {len(closed)}")
+
+@dp.message(Command('create_temp_pass'))
+async def create_temp_pass(message: types.Message):
+    """Создание временного пропуска (для гостей)"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    
+    try:
+        days = int(message.text.split()[1])
+    except:
+        return await message.answer("❌ Формат: /create_temp_pass <дней>")
+    
+    guest, png = await repo.create_temp_pass(days)
+    guest_expiry.schedule(guest)
+    await answer_qr(
+        message,
+        guest,
+        repo.update_guest,
+        caption=f"🔑 Временный пропуск создан!\nID: {guest['qr_id']}\nСрок: {days} дн.",
+        as_document=True,
+        png=png
+    )
+
+@dp.message(Command('block_pass'))
+async def block_pass(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    
+    try:
+        doc_id = int(message.text.split()[1])
+        user_type = message.text.split()[2].lower()
+    except:
+        return await message.answer("❌ Формат: /block_pass <ID> <employee/guest>")
+    
+    if user_type == 'employee':
+        await repo.toggle_employee_status(doc_id)
+    elif user_type == 'guest':
+        await repo.toggle_guest_status(doc_id)
+    else:
+        return await message.answer("❌ Неверный тип пользователя")
+    
+    await message.answer(f"✅ Статус пропуска {doc_id} изменён")
+
+@dp.message(Command('logs'))
+async def show_logs(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    
+    logs = await repo.get_recent_access_logs(10)
+    if not logs:
+        return await message.answer("📂 Журнал пуст")
+    
+    text = "📜 Журнал доступа:\n\n"
+    for log in logs:
+        text += (
+            f"Дата: {log['timestamp'][:10]}\n"
+            f"Тип: {log['user_type']}\n"
+            f"ID: {log['user_id']}\n"
+            f"Статус: {log['status']}\n\n"
+        )
+    await message.answer(text)
+    
+def parse_log_args(args: list):
+    """Разбирает '<с> <по> [type=guest] [user=ID] [status=разрешён]'.
+    Даты — 2026-10-01 или 2026-10-01T09:00; дата без времени в конце включает весь день"""
+    start = datetime.fromisoformat(args[0]).isoformat()
+    end = args[1]
+    if len(end) == 10:
+        # Проверяем дату, а не только длину: '2026-13-45' или 'abcdefghij' — ошибка формата
+        end = datetime.strptime(end, '%Y-%m-%d').replace(hour=23, minute=59, second=59, microsecond=999999)
+    else:
+        end = datetime.fromisoformat(end)
+    end = end.isoformat()
+    
+    filters = {}
+    for arg in args[2:]:
+        key, _, value = arg.partition('=')
+        if key == 'type':
+            filters['user_type'] = value
+        elif key == 'user':
+            filters['user_id'] = int(value)
+        elif key == 'status':
+            filters['status'] = value
+        else:
+            raise ValueError(arg)
+    return start, end, filters
+
+@dp.message(Command('log_query'))
+async def export_logs(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    
+    try:
+        start, end, filters = parse_log_args(message.text.split()[1:])
+    except (IndexError, ValueError):
+        return await message.answer(
+            "❌ Формат: /log_query <с> <по> [type=guest] [user=ID] [status=разрешён]\n"
+            "Пример: /log_query 2026-10-01 2026-10-18 type=guest"
+        )
+    
+    # CSV пишется во временный файл построчно и не собирается в памяти целиком
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        count = await repo.export_access_logs(path, start, end, **filters)
+        if not count:
+            return await message.answer("📂 За этот период записей нет")
+        await message.answer_document(
+            types.FSInputFile(path, filename=f"access_{start[:10]}_{end[:10]}.csv"),
+            caption=f"📜 Записей: {count}"
+        )
+    finally:
+        os.remove(path)
+
+ROSTER_FORMAT = (
+    "❌ Формат: пришлите CSV-файл с подписью /import users или /import employees\n"
+    "users: user_id, full_name, vehicle\n"
+    "employees: full_name, position, vehicle\n"
+    "Разделитель — запятая или точка с запятой, кодировка UTF-8 или Windows-1251"
+)
+# Больше Telegram не даёт скачать боту
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+
+@dp.message(Command('import'), F.document)
+async def import_roster(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+
+    args = message.caption.split()[1:]
+    kind = args[0].lower() if args else None
+    if kind not in Repository.ROSTERS:
+        return await message.answer(ROSTER_FORMAT)
+    if (message.document.file_size or 0) > MAX_IMPORT_BYTES:
+        return await message.answer("❌ Файл больше 20 МБ, разбейте его на части")
+
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        await message.bot.download(message.document, destination=path)
+        inserted, errors = await repo.import_roster(kind, path)
+    except (ValueError, UnicodeDecodeError) as e:
+        return await message.answer(f"❌ Не удалось прочитать CSV: {e}")
+    finally:
+        os.remove(path)
+
+    text = f"✅ Добавлено: {inserted}\n⚠️ Строк с ошибками: {len(errors)}"
+    if kind == 'users' and inserted:
+        text += "\nQR-коды выпускаются командой /bulk_qr"
+    lines = [f"строка {line}: {error}" for line, error in errors]
+    if len(lines) > 20:
+        return await message.answer_document(
+            types.BufferedInputFile("\n".join(lines).encode('utf-8'), filename="import_errors.txt"),
+            caption=text
+        )
+    await message.answer("\n".join([text, *lines]))
+
+@dp.message(Command('import'))
+async def import_roster_usage(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    await message.answer(ROSTER_FORMAT)
+
+@dp.message(Command('export'))
+async def export_roster(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+
+    args = message.text.split()[1:]
+    kind = args[0].lower() if args else None
+    if kind not in Repository.ROSTERS:
+        return await message.answer("❌ Формат: /export users или /export employees")
+
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        count = await repo.export_roster(kind, path)
+        await message.answer_document(
+            types.FSInputFile(path, filename=f"{kind}_{datetime.now().strftime('%Y-%m-%d')}.csv"),
+            caption=f"📋 Записей: {count}"
+        )
+    finally:
+        os.remove(path)
+
+@dp.message(Command('log_stats'))
+async def show_log_stats(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    
+    args = message.text.split()[1:]
+    period = 'day'
+    if len(args) > 2 and args[2] in ('day', 'hour'):
+        period = args.pop(2)
+    try:
+        start, end, filters = parse_log_args(args)
+    except (IndexError, ValueError):
+        return await message.answer(
+            "❌ Формат: /log_stats <с> <по> [day/hour] [type=guest] [user=ID]\n"
+            "Пример: /log_stats 2026-10-01 2026-10-18 hour"
+        )
+    
+    stats = await repo.get_access_stats(start, end, period, **filters)
+    if not stats:
+        return await message.answer("📂 За этот период записей нет")
+    
+    lines = [f"{bucket}: ✅ {c['разрешён']} / ❌ {c['отклонён']}" for bucket, c in stats.items()]
+    text = "📊 Проходы:\n\n" + "\n".join(lines)
+    if len(text) > 4000:
+        return await message.answer_document(
+            types.BufferedInputFile("\n".join(lines).encode('utf-8'), filename="stats.txt"),
+            caption="📊 Проходы"
+        )
+    await message.answer(text)
+
+# --- Новостной раздел ---
+class NewsState(StatesGroup):
+    title = State()
+    content = State()
+    media = State()
+
+# Обработчики команд должны быть объявлены ПЕРВЫМИ
+@dp.message(Command('add_news'))
+async def add_news_start(message: types.Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    
+    await state.set_state(NewsState.title)
+    await message.answer("📝 Введите заголовок новости:")
+
+@dp.message(NewsState.title)
+async def process_title(message: types.Message, state: FSMContext):
+    await state.update_data(title=message.text)
+    await state.set_state(NewsState.content)
+    await message.answer("📄 Введите текст новости:")
+
+@dp.message(NewsState.content)
+async def process_content(message: types.Message, state: FSMContext):
+    await state.update_data(content=message.text)
+    await state.set_state(NewsState.media)
+    await message.answer("🖼️ Прикрепите фото/видео/PDF или отправьте 'пропустить':")
+
+@dp.message(NewsState.media)
+async def process_media(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    media_type = None
+    media_id = None
+    
+    if message.text and message.text.lower() == 'пропустить':
+        pass
+    else:
+        if message.photo:
+            media_type = 'photo'
+            media_id = message.photo[-1].file_id
+        elif message.video:
+            media_type = 'video'
+            media_id = message.video.file_id
+        elif message.document:
+            media_type = 'document'
+            media_id = message.document.file_id
+        else:
+            await message.answer("❌ Недопустимый тип файла. Отправьте фото, видео или PDF")
+            return
+
+    await repo.create_news(
+        title=data['title'],
+        content=data['content'],
+        media_type=media_type,
+        media_id=media_id
+    )
+
+    await state.clear()
+    await message.answer("✅ Новость успешно опубликована!")
+
+    # Рассылка уведомлений идёт в фоне, прогресс — в отдельном сообщении
+    await broadcaster.start(
+        text="🎉 Вышла новая новость! Напишите /news чтобы посмотреть",
+        admin_chat_id=message.chat.id
+    )
+
+@dp.message(Command('news'))
+async def show_last_news(message: types.Message):
+    last_news = await repo.get_latest_news()
+    if not last_news:
+        return await message.answer("📰 Новостей пока нет")
+    
+    text = f"<b>Последняя новость:</b>\n\n{last_news['title']}\n\n{last_news['content']}"
+    
+    try:
+        if last_news.get('media_type') == 'photo':
+            await message.answer_photo(last_news['media_id'], caption=text)
+        elif last_news.get('media_type') == 'video':
+            await message.answer_video(last_news['media_id'], caption=text)
+        elif last_news.get('media_type') == 'document':
+            await message.answer_document(last_news['media_id'], caption=text)
+        else:
+            await message.answer(text)
+    except Exception as e:
+        await message.answer("⚠️ Не удалось загрузить медиафайл последней новости")
+        logging.error(f"Ошибка загрузки медиа: {e}")
+
+NEWS_PAGE_SIZE = int(os.getenv("NEWS_PAGE_SIZE", "5"))
+MEDIA_TYPES = {
+    'photo': types.InputMediaPhoto,
+    'video': types.InputMediaVideo,
+    'document': types.InputMediaDocument
+}
+
+async def send_news_item(message: types.Message, item):
+    text = f"<b>{item['title']}</b>\n\n{item['content']}"
+    media_type = item.get('media_type')
+    media_id = item.get('media_id')
+    
+    try:
+        if media_type == 'photo':
+            await message.answer_photo(media_id, caption=text)
+        elif media_type == 'video':
+            await message.answer_video(media_id, caption=text)
+        elif media_type == 'document':
+            await message.answer_document(media_id, caption=text)
+        else:
+            await message.answer(text)
+    except Exception as e:
+        await message.answer(f"⚠️ Не удалось загрузить новость от {item['created_at'][:10]}")
+        logging.error(f"Ошибка загрузки медиа: {e}")
+
+# Telegram не принимает сообщения длиннее 4096 символов
+MESSAGE_LIMIT = 4096
+NEWS_SEPARATOR = "\n\n➖➖➖\n\n"
+
+def news_kind(item) -> str:
+    media_type = item.get('media_type')
+    if media_type in ('photo', 'video'):
+        return 'visual'
+    return 'document' if media_type == 'document' else 'text'
+
+async def send_news_texts(message: types.Message, items: list):
+    """Новости без медиа — сколько влезет в одно сообщение, по порядку"""
+    chunks, size = [[]], 0
+    for item in items:
+        length = len(item['title']) + len(item['content']) + 9  # <b></b> и \n\n
+        if chunks[-1] and size + len(NEWS_SEPARATOR) + length > MESSAGE_LIMIT:
+            chunks.append([])
+            size = 0
+        size += (len(NEWS_SEPARATOR) if chunks[-1] else 0) + length
+        chunks[-1].append(item)
+    for chunk in chunks:
+        try:
+            await message.answer(NEWS_SEPARATOR.join(
+                f"<b>{item['title']}</b>\n\n{item['content']}" for item in chunk
+            ))
+        except TelegramBadRequest as e:
+            # Например, одна новость сама длиннее лимита — шлём по одной
+            logging.error(f"Ошибка отправки новостей: {e}")
+            for item in chunk:
+                await send_news_item(message, item)
+
+async def send_news_page(message: types.Message, before: int = None, after: int = None):
+    items, has_newer, has_older = await repo.get_news_page(before, after, NEWS_PAGE_SIZE)
+    if not items:
+        return await message.answer("📰 Новостей пока нет")
+    
+    # Идём по странице от новых к старым. Подряд идущие фото и видео уходят одним
+    # альбомом, документы — отдельным, новости без медиа — общими сообщениями
+    for kind, group in itertools.groupby(items, key=news_kind):
+        group = list(group)
+        if kind == 'text':
+            await send_news_texts(message, group)
+        elif len(group) < 2:
+            await send_news_item(message, group[0])
+        else:
+            try:
+                await message.answer_media_group([
+                    MEDIA_TYPES[item['media_type']](
+                        media=item['media_id'],
+                        caption=f"<b>{item['title']}</b>\n\n{item['content']}"
+                    )
+                    for item in group
+                ])
+            except Exception as e:
+                logging.error(f"Ошибка отправки альбома новостей: {e}")
+                for item in group:
+                    await send_news_item(message, item)
+    
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"news_after_{items[0].doc_id}"))
+    if has_older:
+        buttons.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"news_before_{items[-1].doc_id}"))
+    await message.answer(
+        f"🗞 Новости с {items[-1]['created_at'][:10]} по {items[0]['created_at'][:10]}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    )
+
+@dp.message(Command('all_news'))
+async def show_all_news(message: types.Message):
+    await send_news_page(message)
+
+@dp.callback_query(F.data.startswith("news_"))
+async def turn_news_page(callback: types.CallbackQuery):
+    _, direction, cursor = callback.data.split('_')
+    # Кнопки со старого сообщения убираем, чтобы листать только с последнего
+    await callback.message.edit_reply_markup(reply_markup=None)
+    if direction == 'before':
+        await send_news_page(callback.message, before=int(cursor))
+    else:
+        await send_news_page(callback.message, after=int(cursor))
+    await callback.answer()
+
+@dp.message(Command('delete_all_news'))
+async def delete_all_news(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+    
+    await repo.delete_all_news()
+    await message.answer("✅ Все новости успешно удалены!")
+
+# Обработчик команды /help
+@dp.message(Command('help'))
+async def show_help(message: types.Message):
+    if is_admin(message.from_user.id):
+        help_text = """
+<b>👑 Администраторские команды:</b>
+/start - Начать работу с ботом
+/reg - Зарегистрировать пользователя (команда для пользователей)
+/generate_user_qr [ФИО] - Сгенерировать QR-код для сотрудника
+/find [ФИО] - Найти пользователя или сотрудника (с опечатками)
+/bulk_qr [ФИО; ФИО] - Массовый выпуск QR-кодов (без аргументов — всем без пропуска)
+/create_temp_pass [дни] - Создать временный гостевой пропуск
+/block_pass [ID] [тип] - Блокировать пропуск (employee/guest)
+/logs - Показать журнал доступа
+/log_query [с] [по] [фильтры] - Выгрузить журнал в CSV
+/log_stats [с] [по] [day/hour] - Статистика проходов
+/stats - Время обработчиков, БД и QR
+/compact - Архивировать старый журнал и удалить мёртвые записи
+/import [users/employees] - Импорт из CSV (файл с этой подписью)
+/export [users/employees] - Выгрузить список в CSV
+/add_news - Добавить новость
+/delete_all_news - Удалить все новости
+/all_news - Показать все новости
+
+<b>👤 Общие команды:</b>
+/my_qrcode - Мой QR-пропуск
+/scan_pass [код] - Сканировать пропуск (или фото QR-кода)
+/news - Последняя новость
+"""
+    else:
+        help_text = """
+<b>📜 Доступные команды:</b>
+/start - Начать работу
+/reg - Пройти регистрацию
+/my_qrcode - Показать мой QR-пропуск
+/scan_pass [код] - Отсканировать пропуск (или пришлите фото QR-кода)
+/news - Посмотреть последнюю новость
+
+<code>По вопросам обращайтесь к администратору</code>
+"""
+    
+    await message.answer(help_text)
+
+@dp.message(Command('compact'))
+async def run_compaction(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+
+    await message.answer("🧹 Чистка БД запущена...")
+    summary = await compactor.run_once()
+    await message.answer(f"✅ Чистка завершена\n{summary}")
+
+@dp.message(Command('stats'))
+async def show_stats(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("🚫 Доступ запрещен")
+
+    await message.answer(metrics.summary())
+
+@dp.message(F.text.startswith('/'))
+async def handle_unknown_command(message: types.Message):
+    await message.answer("⚠️ Такой команды не существует или она неверно написана.")
+
+# Общий обработчик ВСЕГДА В КОНЦЕ
+@dp.message()
+async def register_user(message: types.Message):
+    try:
+        await repo.create_user(message.from_user.id)
+        logging.info(f"Зарегистрирован пользователь: {message.from_user.id}")
+    except Exception as e:
+        logging.error(f"Ошибка регистрации: {e}")
+
+# Периодический сброс буферизованной БД на диск, даже если операций мало
+async def flush_db_periodically():
+    while True:
+        await asyncio.sleep(db.DB_FLUSH_INTERVAL)
+        await repo.flush()
+
+@dp.startup()
+async def on_startup():
+    dp['flush_task'] = asyncio.create_task(flush_db_periodically())
+    # Прерванные рассылки досылает только один воркер
+    if WORKER_INDEX == 0:
+        await broadcaster.resume_unfinished()
+        await compactor.start()
+    await pending.start()
+    await guest_expiry.start()
+    await metrics_server.start()
+    decoder.start()
+
+@dp.shutdown()
+async def on_shutdown():
+    dp['flush_task'].cancel()
+    await broadcaster.stop()
+    await pending.stop()
+    await guest_expiry.stop()
+    await compactor.stop()
+    await digest.stop()
+    await metrics_server.stop()
+    decoder.close()
+    await repo.close()
+
+def run():
+    """Запуск бота (python main.py): polling или webhook, в одном процессе или в BOT_WORKERS"""
+    processes = int(os.getenv("BOT_WORKERS", "1"))
+    webhook = os.getenv("BOT_MODE", "polling") == "webhook"
+    if processes == 1 and not webhook:
+        # Обычный polling aiogram, очереди исполнителей ему не нужны
+        return dp.run_polling(bot)
+
+    tasks = int(os.getenv("UPDATE_TASKS", "8"))
+    queue_size = int(os.getenv("UPDATE_QUEUE_SIZE", "100"))
+    if processes > 1:
+        # Процессы делят одну БД — это умеет только SQLite
+        if db.DB_BACKEND != 'sqlite':
+            raise SystemExit("BOT_WORKERS > 1 работает только с DB_BACKEND=sqlite")
+        update_workers = ProcessWorkers(processes, tasks=tasks, queue_size=queue_size)
+    else:
+        update_workers = UpdateWorkers(dp, bot, workers=tasks, queue_size=queue_size)
+
+    if webhook:
+        WebhookServer(
+            bot, update_workers,
+            secret_token=os.getenv("WEBHOOK_SECRET"),
+            path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            url=os.getenv("WEBHOOK_URL"),
+            allowed_updates=dp.resolve_used_update_types()
+        ).run(host=os.getenv("WEBHOOK_HOST", "0.0.0.0"), port=int(os.getenv("WEBHOOK_PORT", "8080")))
+    else:
+        run_polling(bot, update_workers, allowed_updates=dp.resolve_used_update_types())
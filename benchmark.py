@@ -0,0 +1,377 @@
+"""Нагрузочный прогон обработчиков бота без сети.
+
+    python benchmark.py --records 100000 --iterations 500 --output bench.json
+    python benchmark.py --records 100000 --compare bench.json
+
+База заполняется синтетическими пользователями, гостями, журналом и
+новостями во временной папке, затем поддельные Update проходят через
+настоящий Dispatcher из app.py. Запросы к Telegram перехватывает
+StubSession. Для каждого обработчика считаются пропускная способность,
+p50/p95/p99 задержки и пиковая память процесса. Для scan_photo ещё
+и исходы распознавания: если хоть одно фото не распознано (таймаут,
+ошибка), прогон завершается с ненулевым кодом.
+"""
+import argparse
+import asyncio
+import importlib
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ADMIN_ID = 1
+ADMIN_CHAT_ID = -100
+FIRST_USER_ID = 10_000_000
+
+
+def make_stub_session():
+    # aiogram импортируем здесь, чтобы окружение успело настроиться до app.py
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Document, File, Message, PhotoSize, User
+
+    class StubSession(BaseSession):
+        """Отвечает на методы Bot API правдоподобными объектами без сети"""
+
+        message_ids = itertools.count(1)
+        # file_id -> содержимое файла для bot.download (фото пропусков)
+        files = {}
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield self.files.get(url.rsplit('/', 1)[-1], b'')
+
+        def _message(self, chat_id, **kwargs):
+            return Message(
+                message_id=next(self.message_ids),
+                date=datetime.now(),
+                chat=Chat(id=int(chat_id or 0), type='private'),
+                **kwargs
+            )
+
+        async def make_request(self, bot, method, timeout=None):
+            name = type(method).__name__
+            if name == 'GetMe':
+                return User(id=42, is_bot=True, first_name='bench', username='bench_bot')
+            if name == 'GetFile':
+                return File(file_id=method.file_id, file_unique_id='f', file_path=method.file_id)
+            if name == 'SendPhoto':
+                photo = PhotoSize(file_id=f'photo{next(self.message_ids)}', file_unique_id='p', width=1, height=1)
+                return self._message(method.chat_id, photo=[photo])
+            if name == 'SendDocument':
+                document = Document(file_id=f'doc{next(self.message_ids)}', file_unique_id='d')
+                return self._message(method.chat_id, document=document)
+            if name == 'SendMediaGroup':
+                return [self._message(method.chat_id) for _ in method.media]
+            if name.startswith('Send'):
+                return self._message(method.chat_id, text=getattr(method, 'text', None))
+            return True
+
+    return StubSession()
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def message(self, user_id: int, text: str):
+        from aiogram.types import Update
+        return Update.model_validate({
+            'update_id': next(self._ids),
+            'message': {
+                'message_id': next(self._ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+                'text': text
+            }
+        })
+
+    def photo(self, user_id: int, file_id: str, side: int):
+        from aiogram.types import Update
+        return Update.model_validate({
+            'update_id': next(self._ids),
+            'message': {
+                'message_id': next(self._ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+                'photo': [{'file_id': file_id, 'file_unique_id': file_id, 'width': side, 'height': side}]
+            }
+        })
+
+    def callback(self, user_id: int, data: str):
+        from aiogram.types import Update
+        return Update.model_validate({
+            'update_id': next(self._ids),
+            'callback_query': {
+                'id': str(next(self._ids)),
+                'chat_instance': 'bench',
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'admin'},
+                'data': data,
+                'message': {
+                    'message_id': next(self._ids),
+                    'date': int(time.time()),
+                    'chat': {'id': ADMIN_CHAT_ID, 'type': 'group'},
+                    'text': 'request'
+                }
+            }
+        })
+
+
+PHOTO_SIDE = 1280
+
+
+def pass_photo(png: bytes) -> bytes:
+    from PIL import Image
+    code = Image.open(io.BytesIO(png)).convert('RGB').resize((560, 560))
+    photo = Image.new('RGB', (PHOTO_SIDE, PHOTO_SIDE), (235, 230, 220))
+    photo.paste(code, (360, 300))
+    buffer = io.BytesIO()
+    photo.save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def seed(db, records: int):
+    """Заполняет БД пачками, чтобы подготовка не растягивалась на часы"""
+    now = datetime.now()
+    chunk = 10_000
+    for start in range(0, records, chunk):
+        users = []
+        for i in range(start, min(start + chunk, records)):
+            payload = f"ID: {i}\nФИО: Пользователь {i}"
+            users.append({
+                'user_id': FIRST_USER_ID + i,
+                'full_name': f'Пользователь {i} Бенчмаркович',
+                'vehicle': None,
+                'qr_id': 1_000_000_000 + i,
+                'is_active': True,
+                **db.qr_fields(payload),
+                'created_at': now.isoformat()
+            })
+        db.User.insert_many(users)
+
+    guests = [{
+        'qr_id': 5_000_000_000 + i,
+        'expires_at': (now + timedelta(days=30)).isoformat(),
+        'is_active': True,
+        **db.qr_fields(f"TEMP PASS ID: {5_000_000_000 + i}")
+    } for i in range(max(records // 10, 1))]
+    db.Guest.insert_many(guests)
+
+    for start in range(0, records, chunk):
+        db.AccessLog.log.append_many([{
+            'user_type': 'user',
+            'user_id': FIRST_USER_ID + i,
+            'timestamp': (now - timedelta(seconds=records - i)).isoformat(),
+            'status': 'разрешён' if i % 5 else 'отклонён'
+        } for i in range(start, min(start + chunk, records))])
+
+    db.News.insert_many([{
+        'title': f'Новость {i}',
+        'content': 'Текст новости',
+        'media_type': None,
+        'media_id': None,
+        'created_at': now.isoformat()
+    } for i in range(max(records // 1000, 10))])
+    db.flush()
+
+
+def percentile(values: list, q: float) -> float:
+    return values[min(int(round(q * (len(values) - 1))), len(values) - 1)]
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'throughput_per_s': round(len(values) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+async def measure(dp, bot, updates):
+    latencies = []
+    started = time.perf_counter()
+    for update in updates:
+        t = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies.append(time.perf_counter() - t)
+    return latencies, time.perf_counter() - started
+
+
+async def run_benchmarks(app, db, records: int, iterations: int) -> dict:
+    dp, bot = app.dp, app.bot
+    factory = UpdateFactory()
+    results = {}
+    await dp.emit_startup(bot=bot)
+    try:
+        users = [FIRST_USER_ID + (i * 7919) % records for i in range(iterations)]
+
+        # /scan_pass: каждый раз другой пользователь, чтобы запросы не склеивались
+        updates = [factory.message(uid, f'/scan_pass {1_000_000_000 + uid - FIRST_USER_ID}') for uid in users]
+        results['handle_scan'] = summarize(*await measure(dp, bot, updates))
+
+        # Решения администратора по только что созданным запросам
+        updates = []
+        for uid in users:
+            request = app.pending.get_by_pass_id(1_000_000_000 + uid - FIRST_USER_ID)
+            if request is not None:
+                updates.append(factory.callback(ADMIN_ID, f"access_allow_{request['pass_id']}_{request.doc_id}"))
+        if updates:
+            results['handle_access_decision'] = summarize(*await measure(dp, bot, updates))
+
+        # Тот же скан с подписанным QR: подпись и срок проверяются без БД.
+        # Предыдущие запросы уже закрыты решением администратора
+        import pass_token
+        updates = [
+            factory.message(uid, f'/scan_pass {pass_token.sign(pass_token.USER, 1_000_000_000 + uid - FIRST_USER_ID)}')
+            for uid in users
+        ]
+        results['handle_scan_signed'] = summarize(*await measure(dp, bot, updates))
+
+        updates = [factory.message(ADMIN_ID, '/logs') for _ in range(iterations)]
+        results['show_logs'] = summarize(*await measure(dp, bot, updates))
+
+        # Поиск по ФИО с опечаткой по индексу триграмм
+        updates = [
+            factory.message(ADMIN_ID, f'/find Пользоватль {uid - FIRST_USER_ID} Бенчмаркович') for uid in users
+        ]
+        results['find_people'] = summarize(*await measure(dp, bot, updates))
+
+        updates = [factory.message(uid, '/my_qrcode') for uid in users]
+        results['show_my_qrcode'] = summarize(*await measure(dp, bot, updates))
+
+        updates = [factory.message(uid, '/news') for uid in users]
+        results['show_last_news'] = summarize(*await measure(dp, bot, updates))
+
+        # process_media: шаги FSM до медиа не замеряются, только публикация
+        latencies, elapsed = [], 0.0
+        for i in range(max(iterations // 10, 5)):
+            for text in ('/add_news', f'Бенчмарк {i}', 'Текст'):
+                await dp.feed_update(bot, factory.message(ADMIN_ID, text))
+            step, step_elapsed = await measure(dp, bot, [factory.message(ADMIN_ID, 'пропустить')])
+            latencies += step
+            elapsed += step_elapsed
+        results['process_media'] = summarize(latencies, elapsed)
+
+        # Фото пропуска: PNG из User.generate_qr на светлом фоне, пережатый в JPEG, как делает Telegram
+        if app.qr_decoder.available():
+            photo_users = [FIRST_USER_ID + (i * 104729 + 13) % records for i in range(max(iterations // 10, 5))]
+            updates = []
+            for uid in photo_users:
+                file_id = f'pass{uid}'
+                bot.session.files[file_id] = pass_photo(db.User.generate_qr(uid))
+                updates.append(factory.photo(uid, file_id, PHOTO_SIDE))
+            before = decode_outcomes(app.metrics)
+            results['scan_photo'] = summarize(*await measure(dp, bot, updates))
+            # Таймаут тоже даёт «быструю» задержку — без исходов прогон выглядел бы успешным
+            outcomes = decode_outcomes(app.metrics, before)
+            results['scan_photo']['outcomes'] = outcomes
+            results['scan_photo']['failed'] = outcomes.get('found', 0) < len(updates)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+    return results
+
+
+def decode_outcomes(metrics, before: dict = None) -> dict:
+    """Сколько распознаваний закончилось каждым исходом (found, timeout...), с момента before"""
+    before = before or {}
+    counts = {labels[0]: count for labels, (_, _, count) in metrics.QR_DECODE_SECONDS.series().items()}
+    return {outcome: count - before.get(outcome, 0) for outcome, count in counts.items()
+            if count > before.get(outcome, 0)}
+
+
+def compare(current: dict, previous: dict):
+    print(f"\n{'обработчик':<24}{'p95, мс':>22}{'в секунду':>26}")
+    for name, now in current['handlers'].items():
+        before = previous.get('handlers', {}).get(name)
+        if not before:
+            print(f"{name:<24}{now['p95_ms']:>22}{now['throughput_per_s']:>26}")
+            continue
+        p95_change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+        tps_change = ((now['throughput_per_s'] - before['throughput_per_s']) / before['throughput_per_s'] * 100
+                      if before['throughput_per_s'] else 0)
+        print(f"{name:<24}{before['p95_ms']:>9} → {now['p95_ms']:<8}({p95_change:+.0f}%)"
+              f"{before['throughput_per_s']:>10} → {now['throughput_per_s']:<8}({tps_change:+.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон обработчиков бота')
+    parser.add_argument('--records', type=int, default=10_000, help='число пользователей и записей журнала')
+    parser.add_argument('--iterations', type=int, default=200, help='запросов на обработчик')
+    parser.add_argument('--workdir', help='папка для БД (по умолчанию временная)')
+    parser.add_argument('--output', help='куда сохранить результаты в JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='tgbot-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    # Окружение задаём до импорта database.py и app.py — они читают его при импорте
+    os.environ.update({
+        'BOT_TOKEN': '123456:BENCHMARK',
+        'ADMIN_IDS': str(ADMIN_ID),
+        'ADMIN_CHAT_ID': str(ADMIN_CHAT_ID),
+        'DB_PATH': os.path.join(workdir, 'db.json'),
+        'SQLITE_PATH': os.path.join(workdir, 'db.sqlite3'),
+        'ACCESS_LOG_DIR': os.path.join(workdir, 'access_logs'),
+        'FSM_PATH': os.path.join(workdir, 'fsm.sqlite3'),
+    })
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.INFO)
+
+    db = importlib.import_module('database')
+    started = time.perf_counter()
+    seed(db, args.records)
+    seed_seconds = time.perf_counter() - started
+
+    bot_app = importlib.import_module('app')
+    bot_app.bot.session = make_stub_session()
+    handlers = asyncio.run(run_benchmarks(bot_app, db, args.records, args.iterations))
+
+    result = {
+        'meta': {
+            'records': args.records,
+            'iterations': args.iterations,
+            'backend': db.DB_BACKEND,
+            'storage': db.DB_STORAGE,
+            'python': platform.python_version(),
+            'started_at': datetime.now().isoformat(),
+            'seed_seconds': round(seed_seconds, 2),
+            'workdir': workdir
+        },
+        'handlers': handlers
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if previous:
+        compare(result, previous)
+    failed = [name for name, summary in handlers.items() if summary.get('failed')]
+    if failed:
+        sys.exit(f"Прогон неудачный: {', '.join(failed)} (см. outcomes)")
+
+
+if __name__ == '__main__':
+    main()
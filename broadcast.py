@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+
+from repository import Repository
+
+
+class TokenBucket:
+    """Ограничение скорости: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def pause(self, seconds: float):
+        """Flood wait: уводим запас в минус, чтобы все отправители подождали"""
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class Broadcaster:
+    """Фоновая рассылка сообщений всем пользователям.
+
+    Скорость ограничена общим токен-бакетом (лимит Telegram ~30 сообщений
+    в секунду) и интервалом между сообщениями в один чат. Курсор
+    сохраняется в таблицу broadcasts после каждой пачки."""
+
+    # Лимит Telegram на сообщения в один чат
+    PER_CHAT_INTERVAL = 1.0
+    PROGRESS_INTERVAL = 5.0
+
+    def __init__(self, bot: Bot, repo: Repository, rate: float = 25, concurrency: int = 20,
+                 max_retries: int = 3):
+        self.bot = bot
+        self.repo = repo
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate, rate)
+        self._chat_last_sent = {}
+        self._tasks = set()
+
+    async def start(self, text: str, admin_chat_id: int):
+        users = await self.repo.get_all_users()
+        status = await self.bot.send_message(
+            chat_id=admin_chat_id,
+            text=f"📣 Рассылка запущена: 0/{len(users)}"
+        )
+        job = await self.repo.create_broadcast(text, admin_chat_id, status.message_id, len(users))
+        self._spawn(job)
+
+    async def resume_unfinished(self):
+        for job in await self.repo.get_unfinished_broadcasts():
+            logging.info(f"Продолжаем рассылку {job.doc_id} с курсора {job['cursor']}")
+            self._spawn(job)
+
+    async def stop(self):
+        # Курсор уже в БД — после перезапуска рассылка продолжится
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _spawn(self, job):
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job):
+        users = await self.repo.get_all_users()
+        users = sorted((u for u in users if u.doc_id > job['cursor']), key=lambda u: u.doc_id)
+        delivered, failed = job['delivered'], job['failed']
+        last_report = 0.0
+
+        for i in range(0, len(users), self.concurrency):
+            chunk = users[i:i + self.concurrency]
+            results = await asyncio.gather(*(self._send(u['user_id'], job['text']) for u in chunk))
+            delivered += sum(results)
+            failed += len(results) - sum(results)
+            await self.repo.update_broadcast(job.doc_id, {
+                'cursor': chunk[-1].doc_id,
+                'delivered': delivered,
+                'failed': failed
+            })
+            if time.monotonic() - last_report >= self.PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await self._report(job, f"📣 Рассылка: {delivered + failed}/{job['total']}")
+
+        await self.repo.update_broadcast(job.doc_id, {'status': 'done'})
+        await self._report(
+            job,
+            f"✅ Рассылка завершена\nДоставлено: {delivered}\nНе доставлено: {failed}"
+        )
+
+    async def _send(self, chat_id: int, text: str) -> bool:
+        for _ in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await self._bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                self._chat_last_sent[chat_id] = time.monotonic()
+                return True
+            except TelegramRetryAfter as e:
+                logging.warning(f"Flood limit, пауза {e.retry_after} с")
+                self._bucket.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат удалён и т.п. — повтор не поможет
+                logging.error(f"Ошибка отправки пользователю {chat_id}: {e}")
+                return False
+        return False
+
+    async def _wait_for_chat(self, chat_id: int):
+        last = self._chat_last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.PER_CHAT_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if len(self._chat_last_sent) > 10000:
+            threshold = time.monotonic() - self.PER_CHAT_INTERVAL
+            self._chat_last_sent = {k: v for k, v in self._chat_last_sent.items() if v > threshold}
+
+    async def _report(self, job, text: str):
+        try:
+            await self.bot.edit_message_text(
+                text=text,
+                chat_id=job['admin_chat_id'],
+                message_id=job['status_message_id']
+            )
+        except TelegramBadRequest as e:
+            # "message is not modified" и удалённое сообщение не мешают рассылке
+            logging.warning(f"Не удалось обновить статус рассылки: {e}")
+        except TelegramAPIError as e:
+            logging.error(f"Ошибка отчёта о рассылке: {e}")
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import qr_service
+from repository import Repository
+
+
+class Compactor:
+    """Периодическая чистка данных, которые иначе копятся бесконечно.
+
+    Записи журнала старше log_retention_days уходят в сжатые помесячные
+    архивы (по ним по-прежнему работают /log_query и /log_stats), запросы
+    на проход, оставшиеся после падений, и гости, чей срок истёк больше
+    guest_retention_days назад, удаляются, а файл БД ужимается.
+    Работает на ходу: запись журнала и БД во время чистки не блокируется."""
+
+    def __init__(self, repo: Repository, interval: float = 24 * 3600, log_retention_days: float = 90,
+                 guest_retention_days: float = 30, pending_grace: float = 3600):
+        self.repo = repo
+        self.interval = interval
+        self.log_retention = timedelta(days=log_retention_days)
+        self.guest_retention = timedelta(days=guest_retention_days)
+        # Запросы снимает реестр в pending.py; здесь — только забытые им надолго
+        self.pending_grace = pending_grace
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        if self.interval:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        # Первый проход — через интервал, а не при каждом перезапуске бота
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"Ошибка чистки БД: {e}")
+
+    async def run_once(self) -> str:
+        """Один проход чистки; возвращает сводку для администратора"""
+        async with self._lock:
+            now = datetime.now()
+            archived, pending, guests = await self.repo.compact(
+                log_before=(now - self.log_retention).isoformat(),
+                guests_before=now - self.guest_retention,
+                pending_before=time.time() - self.pending_grace
+            )
+            for guest in guests:
+                qr_service.cache.discard(guest['qr_id'])
+                if guest.get('qr_code_path') and os.path.exists(guest['qr_code_path']):
+                    await self.repo.run_qr(os.remove, guest['qr_code_path'])
+
+        summary = (
+            f"Записей журнала в архиве: {archived}\n"
+            f"Удалено запросов на проход: {pending}\n"
+            f"Удалено гостевых пропусков: {len(guests)}"
+        )
+        logging.info(f"Чистка БД завершена. {summary}")
+        return summary
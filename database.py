@@ -1,19 +1,359 @@
 from tinydb import TinyDB, Query
 from datetime import datetime, timedelta
+from dotenv import load_dotenv
 import qrcode
+import bisect
+import csv
+import multiprocessing
 import os
 import secrets
+import time
+
+import qr_service
+import pass_token
+from storage import BufferedJSONStorage
+from sqlite_db import SQLiteDatabase
+from access_log import SegmentedLog
+from name_index import NameIndex
+
+load_dotenv()
+
+# tinydb — файл db.json, sqlite — SQLite в режиме WAL с настоящими индексами
+DB_BACKEND = os.getenv('DB_BACKEND', 'tinydb')
+DB_PATH = os.getenv('DB_PATH', 'db.json')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'db.sqlite3')
+# buffered — таблицы в памяти, запись в файл пачками; json — запись на каждую операцию
+DB_STORAGE = os.getenv('DB_STORAGE', 'buffered')
+DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', '2'))
+DB_FLUSH_OPS = int(os.getenv('DB_FLUSH_OPS', '50'))
+ACCESS_LOG_DIR = os.getenv('ACCESS_LOG_DIR', 'access_logs')
 
-db = TinyDB('db.json')
 #бд создается при первом запуске main.py
+if DB_BACKEND == 'sqlite':
+    db = SQLiteDatabase(SQLITE_PATH)
+elif DB_STORAGE == 'buffered':
+    db = TinyDB(
+        DB_PATH,
+        storage=BufferedJSONStorage,
+        flush_interval=DB_FLUSH_INTERVAL,
+        flush_ops=DB_FLUSH_OPS
+    )
+else:
+    db = TinyDB(DB_PATH)
+
+
+def flush():
+    """Сбрасывает накопленные изменения на диск"""
+    if DB_BACKEND == 'tinydb' and isinstance(db.storage, BufferedJSONStorage):
+        db.storage.flush()
+
+
+def data_version() -> int:
+    """Версия данных для сброса кэшей, когда БД меняют несколько процессов.
+    У TinyDB файл принадлежит одному процессу, поэтому версия не меняется"""
+    if DB_BACKEND == 'sqlite':
+        return db.data_version()
+    return 0
+
+
+def compact():
+    """Возвращает место после чистки старых записей: SQLite освобождает
+    пустые страницы (можно звать из любого потока), db.json переписывается атомарно"""
+    if DB_BACKEND == 'sqlite':
+        db.vacuum()
+    elif isinstance(db.storage, BufferedJSONStorage):
+        db.storage.compact()
+    # JSONStorage и так переписывает db.json на каждую операцию
+
+
+def close():
+    db.close()
+    AccessLog.log.close()
+
+
+def qr_fields(payload: str, qr_path: str = None) -> dict:
+    """Поля записи для нового QR-кода. По payload картинку можно
+    перерисовать в любой момент, поэтому файл на диске необязателен.
+    file_id от Telegram относятся к старой картинке и сбрасываются"""
+    return {
+        'qr_payload': payload,
+        'qr_code_path': qr_path,
+        'qr_file_id': None,
+        'qr_document_file_id': None
+    }
+
+
+def qr_disk_path(path: str):
+    return path if qr_service.QR_SAVE_TO_DISK else None
+
+
+# Русские заголовки из кадровых таблиц -> поля записей
+CSV_ALIASES = {
+    'telegram_id': 'user_id',
+    'фио': 'full_name',
+    'должность': 'position',
+    'тс': 'vehicle',
+    'транспорт': 'vehicle',
+}
+
+
+def csv_encoding(path: str) -> str:
+    """UTF-8 или cp1251, в которой русский Excel сохраняет CSV"""
+    with open(path, 'rb') as f:
+        sample = f.read(65536)
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Ошибка в самом конце — просто обрезанный многобайтный символ
+        if e.start < len(sample) - 3:
+            return 'cp1251'
+    return 'utf-8-sig'
+
+
+def read_csv(path: str, required=()):
+    """Строки CSV по одной: (номер строки, {поле: значение}).
+    Разделитель (запятая, точка с запятой из Excel или табуляция) и кодировка
+    определяются по началу файла; без колонок из required бросает ValueError"""
+    with open(path, newline='', encoding=csv_encoding(path)) as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=',;\t').delimiter
+        except csv.Error:
+            delimiter = ','
+        # Кавычки всегда двойные, как у Excel и export_csv: по ФИО с апострофами
+        # Sniffer иначе принимает апостроф за кавычку и склеивает строки
+        reader = csv.DictReader(f, dialect=csv.excel, delimiter=delimiter)
+        fields = [(name or '').strip().lower() for name in reader.fieldnames or ()]
+        reader.fieldnames = [CSV_ALIASES.get(name, name) for name in fields]
+        missing = [name for name in required if name not in reader.fieldnames]
+        if missing:
+            raise ValueError(f"нет колонок: {', '.join(missing)}")
+        for row in reader:
+            # Лишние ячейки без заголовка DictReader складывает списком под ключом None
+            yield reader.line_num, {
+                name: csv_unescape(value) if name in CSV_TEXT_FIELDS else (value or '').strip()
+                for name, value in row.items() if name
+            }
+
+
+def csv_unescape(value) -> str:
+    """Снимает апостроф, которым csv_safe защитил текстовую ячейку при выгрузке"""
+    value = (value or '').strip()
+    if value.startswith("'") and value[1:].startswith(CSV_ESCAPED_CHARS):
+        return value[1:]
+    return value
+
+
+# Ячейка с этих символов в Excel становится формулой
+CSV_FORMULA_CHARS = ('=', '+', '-', '@', '\t', '\r')
+# Апостроф в начале тоже экранируется: тогда снять ровно один апостроф при
+# импорте всегда верно, и '-5 или 'Иванов после выгрузки и загрузки не меняются
+CSV_ESCAPED_CHARS = CSV_FORMULA_CHARS + ("'",)
+# Свободный текст, который выгружается и загружается обратно. Числа (user_id)
+# и даты не экранируются, поэтому апостроф в них при импорте не трогаем
+CSV_TEXT_FIELDS = ('full_name', 'position', 'vehicle')
+
+
+def csv_safe(value):
+    """Экранирует ячейку апострофом, чтобы ФИО вида =HYPERLINK(...) осталось текстом"""
+    if isinstance(value, str) and value.startswith(CSV_ESCAPED_CHARS):
+        return "'" + value
+    return value
+
+
+def vehicle_value(row: dict):
+    vehicle = row.get('vehicle') or ''
+    return vehicle if vehicle.lower() != 'нет' else None
+
 class BaseModel:
+    table = None
+    # Поля, по которым держим хэш-индексы в памяти: значение -> doc_id
+    indexes = ()
+    # В SQLite индексы настоящие, и словари в памяти не нужны
+    _indexes = {}
+    # Тип пропуска в pass_token: у таких моделей is_active поддерживает список отозванных
+    pass_type = None
+    # Поле для нечёткого поиска (search): триграммный индекс в памяти при любом бэкенде
+    search_field = None
+    _search = None
+    _search_version = None
+    _search_last_id = 0
+
+    @classmethod
+    def build_indexes(cls):
+        """Перестраивает индексы по содержимому таблицы (при старте)"""
+        if cls.search_field:
+            cls._sync_search()
+        if DB_BACKEND == 'sqlite':
+            cls.table.create_indexes(cls.indexes)
+            return
+        cls._indexes = {field: {} for field in cls.indexes}
+        for doc in cls.table.all():
+            cls._index_add(doc.doc_id, doc)
+
+    @classmethod
+    def _sync_search(cls):
+        """Строит индекс поиска, а в SQLite дочитывает записи, добавленные другими
+        процессами. Свои вставки и изменения индекс получает сразу из insert/update"""
+        version = data_version()
+        if cls._search is not None and version == cls._search_version:
+            return
+        if cls._search is None:
+            cls._search, cls._search_last_id = NameIndex(), 0
+            docs = cls.table.all()
+        else:
+            docs = cls.table.all_after(cls._search_last_id)
+        cls._search_version = version
+        for doc in docs:
+            cls._search.add(doc.doc_id, doc.get(cls.search_field))
+            cls._search_last_id = max(cls._search_last_id, doc.doc_id)
+
+    @classmethod
+    def _search_add(cls, doc_id: int, data: dict):
+        if cls._search is not None and cls.search_field in data:
+            cls._search.add(doc_id, data[cls.search_field])
+
+    @classmethod
+    def _search_remove(cls, doc_id: int):
+        if cls._search is not None:
+            cls._search.remove(doc_id)
+
+    @classmethod
+    def search(cls, query: str, limit: int = 10):
+        """Нечёткий поиск по search_field с учётом опечаток, ё/е и порядка слов:
+        [(запись, оценка от 0 до 1)] по убыванию оценки"""
+        cls._sync_search()
+        results = []
+        for doc_id, score in cls._search.search(query, limit):
+            doc = cls.get_by_id(doc_id)
+            if doc is None:
+                # Удалена другим процессом
+                cls._search.remove(doc_id)
+                continue
+            results.append((doc, score))
+        return results
+
+    @classmethod
+    def _index_add(cls, doc_id: int, doc: dict):
+        for field, index in cls._indexes.items():
+            if field in doc:
+                # dict вместо set, чтобы сохранить порядок вставки
+                index.setdefault(doc[field], {})[doc_id] = None
+
+    @classmethod
+    def _index_remove(cls, doc_id: int, doc: dict):
+        for field, index in cls._indexes.items():
+            if field not in doc:
+                continue
+            doc_ids = index.get(doc[field])
+            if doc_ids is not None:
+                doc_ids.pop(doc_id, None)
+                if not doc_ids:
+                    del index[doc[field]]
+
+    @classmethod
+    def get_by(cls, field: str, value):
+        """Первая запись с field == value без сканирования таблицы"""
+        if DB_BACKEND == 'sqlite':
+            docs = cls.table.search_by(field, value)
+            return docs[0] if docs else None
+        doc_ids = cls._indexes[field].get(value)
+        if not doc_ids:
+            return None
+        return cls.table.get(doc_id=next(iter(doc_ids)))
+
+    @classmethod
+    def find_by(cls, field: str, value):
+        if DB_BACKEND == 'sqlite':
+            return cls.table.search_by(field, value)
+        doc_ids = cls._indexes[field].get(value, ())
+        return [cls.table.get(doc_id=doc_id) for doc_id in doc_ids]
+
     @classmethod
     def get_by_id(cls, doc_id: int):
         return cls.table.get(doc_id=doc_id)
 
+    @classmethod
+    def insert(cls, data: dict):
+        doc_id = cls.table.insert(data)
+        cls._index_add(doc_id, data)
+        cls._search_add(doc_id, data)
+        return doc_id
+
+    @classmethod
+    def insert_many(cls, documents: list):
+        """Вставляет пачку записей одной операцией с хранилищем"""
+        doc_ids = cls.table.insert_multiple(documents)
+        for doc_id, data in zip(doc_ids, documents):
+            cls._index_add(doc_id, data)
+            cls._search_add(doc_id, data)
+        return doc_ids
+
     @classmethod
     def update(cls, doc_id: int, data: dict):
+        old = cls.table.get(doc_id=doc_id) if cls._indexes else None
         cls.table.update(data, doc_ids=[doc_id])
+        if old is not None and any(field in data for field in cls._indexes):
+            cls._index_remove(doc_id, old)
+            cls._index_add(doc_id, {**old, **data})
+        cls._search_add(doc_id, data)
+        if cls.pass_type and 'is_active' in data:
+            cls._track_revocation(doc_id, old, data['is_active'])
+
+    @classmethod
+    def update_many(cls, updates: dict):
+        """Обновляет сразу несколько записей {doc_id: data} одной операцией с хранилищем"""
+        if not updates:
+            return
+        olds = {doc_id: cls.table.get(doc_id=doc_id) for doc_id in updates} if cls._indexes else {}
+        if DB_BACKEND == 'sqlite':
+            cls.table.update_many(updates)
+        else:
+            # TinyDB вызывает функцию для doc_ids строго по порядку,
+            # поэтому данные берём из итератора в том же порядке
+            pending = iter(updates.values())
+            cls.table.update(lambda doc: doc.update(next(pending)), doc_ids=list(updates))
+        for doc_id, old in olds.items():
+            if old is not None and any(field in updates[doc_id] for field in cls._indexes):
+                cls._index_remove(doc_id, old)
+                cls._index_add(doc_id, {**old, **updates[doc_id]})
+        for doc_id, data in updates.items():
+            cls._search_add(doc_id, data)
+        if cls.pass_type:
+            for doc_id, data in updates.items():
+                if 'is_active' in data:
+                    cls._track_revocation(doc_id, olds.get(doc_id), data['is_active'])
+
+    @classmethod
+    def _track_revocation(cls, doc_id: int, doc, is_active: bool):
+        doc = doc if doc is not None else cls.get_by_id(doc_id)
+        if doc is not None and doc.get('qr_id') is not None:
+            pass_token.set_revoked(cls.pass_type, doc['qr_id'], not is_active)
+
+    @classmethod
+    def remove(cls, doc_id: int):
+        """Возвращает True, если документ удалил именно этот вызов"""
+        old = cls.table.get(doc_id=doc_id)
+        if old is None:
+            return False
+        removed = cls.table.remove(doc_ids=[doc_id])
+        cls._index_remove(doc_id, old)
+        cls._search_remove(doc_id)
+        return bool(removed)
+
+    @classmethod
+    def remove_many(cls, doc_ids: list):
+        """Удаляет записи одной операцией и возвращает doc_id реально удалённых"""
+        olds = {doc_id: cls.table.get(doc_id=doc_id) for doc_id in doc_ids}
+        olds = {doc_id: old for doc_id, old in olds.items() if old is not None}
+        if not olds:
+            return []
+        removed = cls.table.remove(doc_ids=list(olds))
+        for doc_id in removed:
+            cls._index_remove(doc_id, olds[doc_id])
+            cls._search_remove(doc_id)
+        return removed
 
     @classmethod
     def get_all(cls):
@@ -22,66 +362,195 @@ class BaseModel:
     @classmethod
     def truncate(cls):
         cls.table.truncate()
+        if cls._indexes:
+            cls._indexes = {field: {} for field in cls.indexes}
+        if cls._search is not None:
+            cls._search.clear()
+
+    @classmethod
+    def new_qr_id(cls, taken=()):
+        """Случайный qr_id, которого нет ни в таблице, ни среди taken (выданных в той же пачке)"""
+        qr_id = secrets.randbelow(10**10)
+        while qr_id in taken or cls.get_by('qr_id', qr_id):
+            qr_id = secrets.randbelow(10**10)
+        return qr_id
+
+    @classmethod
+    def iter_all(cls):
+        """Все записи по одной, не собирая таблицу в список"""
+        if DB_BACKEND == 'sqlite':
+            return cls.table.iter_all()
+        return iter(cls.table)
+
+    @classmethod
+    def export_csv(cls, path: str):
+        """Пишет таблицу в CSV построчно (колонки csv_fields) и возвращает число строк"""
+        count = 0
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(cls.csv_fields)
+            for doc in cls.iter_all():
+                writer.writerow([csv_safe(doc.get(field)) for field in cls.csv_fields])
+                count += 1
+        return count
 
 class User(BaseModel):
     table = db.table('users')
+    # is_active — чтобы PassRevocations читал только заблокированные пропуска
+    indexes = ('user_id', 'qr_id', 'full_name', 'is_active')
+    search_field = 'full_name'
+    pass_type = pass_token.USER
     
+    csv_fields = ('user_id', 'full_name', 'vehicle', 'qr_id', 'is_active', 'created_at')
+
     @classmethod
     def create(cls, user_id: int, full_name: str, vehicle: str = None):
-        if cls.table.get(Query().user_id == user_id):
+        if cls.get_by('user_id', user_id):
             return False
         
-        qr_id = secrets.randbelow(10**10)
-        while cls.table.get(Query().qr_id == qr_id):
-            qr_id = secrets.randbelow(10**10)
-        
-        cls.table.insert({
+        cls.insert(cls._document(user_id, full_name, vehicle, cls.new_qr_id()))
+        return True
+
+    @staticmethod
+    def _document(user_id: int, full_name: str, vehicle: str, qr_id: int) -> dict:
+        return {
             'user_id': user_id,
             'full_name': full_name,
             'vehicle': vehicle,
             'qr_id': qr_id,
             'is_active': True,
+            'qr_payload': None,
             'qr_code_path': None,
+            'qr_file_id': None,  # file_id фото из Telegram, чтобы не загружать PNG повторно
+            'qr_document_file_id': None,
             'created_at': datetime.now().isoformat()
-        })
-        return True
+        }
+
+    @classmethod
+    def import_csv(cls, path: str):
+        """Пользователи из CSV (user_id, full_name, vehicle) одной пачкой.
+        Возвращает число добавленных и ошибки [(номер строки, текст)]"""
+        documents, errors, seen, taken = [], [], set(), set()
+        for line, row in read_csv(path, required=('user_id', 'full_name')):
+            try:
+                user_id = int(row['user_id'])
+            except ValueError:
+                errors.append((line, f"user_id должен быть числом: {row['user_id']!r}"))
+                continue
+            if len(row['full_name'].split()) < 3:
+                errors.append((line, f"нужно полное ФИО: {row['full_name']!r}"))
+                continue
+            if user_id in seen or cls.get_by('user_id', user_id):
+                errors.append((line, f"пользователь {user_id} уже есть"))
+                continue
+            seen.add(user_id)
+            qr_id = cls.new_qr_id(taken)
+            taken.add(qr_id)
+            documents.append(cls._document(user_id, row['full_name'], vehicle_value(row), qr_id))
+        cls.insert_many(documents)
+        return len(documents), errors
+
+    @staticmethod
+    def qr_payload(user: dict) -> str:
+        """Подписанный бессрочный пропуск (см. pass_token.py)"""
+        return pass_token.sign(pass_token.USER, user['qr_id'])
+
+    @staticmethod
+    def qr_path(user_id: int) -> str:
+        return f'qrcodes/user_{user_id}.png'
 
     @classmethod
     def generate_qr(cls, user_id: int):
-        user = cls.table.get(Query().user_id == user_id)
+        user = cls.get_by('user_id', user_id)
         if not user:
             return None
         
-        qr_data = f"""
-            ID: {user['qr_id']}
-            ФИО: {user['full_name']}
-            ТС: {user['vehicle'] or 'Нет'}
-            Дата: {datetime.now().strftime('%d.%m.%Y')}
-        """
-        qr = qrcode.make(qr_data)
-        qr_path = f'qrcodes/user_{user_id}.png'
-        os.makedirs('qrcodes', exist_ok=True)
-        qr.save(qr_path)
+        payload = cls.qr_payload(user)
+        qr_path = qr_disk_path(cls.qr_path(user_id))
+        png = qr_service.get_png(user['qr_id'], payload, qr_path)
         
-        cls.update(user.doc_id, {'qr_code_path': qr_path})
-        return qr_path
+        cls.update(user.doc_id, qr_fields(payload, qr_path))
+        return png
 # --- Новостной раздел ---
 class News(BaseModel):
     table = db.table('news')
+    # Кэш ленты: последняя новость, отсортированные doc_id и готовые страницы.
+    # Сбрасывается при create и truncate, а также когда БД изменил другой процесс
+    _latest = None
+    _ids = None
+    _pages = {}
+    _version = None
+    MAX_CACHED_PAGES = 64
     
     @classmethod
     def create(cls, title: str, content: str, media_type: str = None, media_id: str = None):
-        return cls.table.insert({
+        doc_id = cls.insert({
             'title': title,
             'content': content,
             'media_type': media_type,
             'media_id': media_id,
             'created_at': datetime.now().isoformat()
         })
+        cls._invalidate_feed()
+        return doc_id
     
     @classmethod
     def get_all(cls):
         return cls.table.all()
+
+    @classmethod
+    def truncate(cls):
+        super().truncate()
+        cls._invalidate_feed()
+
+    @classmethod
+    def _invalidate_feed(cls):
+        cls._latest = None
+        cls._ids = None
+        cls._pages = {}
+
+    @classmethod
+    def _sync_feed(cls):
+        version = data_version()
+        if version != cls._version:
+            cls._invalidate_feed()
+            cls._version = version
+
+    @classmethod
+    def _feed_ids(cls):
+        if cls._ids is None:
+            cls._ids = sorted(doc.doc_id for doc in cls.table.all())
+        return cls._ids
+
+    @classmethod
+    def latest(cls):
+        cls._sync_feed()
+        if cls._latest is None:
+            ids = cls._feed_ids()
+            cls._latest = cls.get_by_id(ids[-1]) if ids else None
+        return cls._latest
+
+    @classmethod
+    def page(cls, before: int = None, after: int = None, size: int = 5):
+        """Страница ленты от новых к старым: старше before или новее after.
+        Возвращает (новости, есть ли новее, есть ли старее)"""
+        cls._sync_feed()
+        key = (before, after, size)
+        if key not in cls._pages:
+            ids = cls._feed_ids()
+            if after is not None:
+                start = bisect.bisect_right(ids, after)
+                page_ids = ids[start:start + size]
+            else:
+                end = bisect.bisect_left(ids, before) if before is not None else len(ids)
+                page_ids = ids[max(end - size, 0):end]
+            items = [cls.get_by_id(doc_id) for doc_id in reversed(page_ids)]
+            has_newer = bool(page_ids) and page_ids[-1] < ids[-1]
+            has_older = bool(page_ids) and page_ids[0] > ids[0]
+            if len(cls._pages) >= cls.MAX_CACHED_PAGES:
+                cls._pages.pop(next(iter(cls._pages)))
+            cls._pages[key] = (items, has_newer, has_older)
+        return cls._pages[key]
     
     @classmethod
     def generate_qr(cls, user_id: int):
@@ -110,17 +579,43 @@ class News(BaseModel):
 
 class Employee(BaseModel):
     table = db.table('employees')
+    indexes = ('full_name',)
+    search_field = 'full_name'
+    csv_fields = ('full_name', 'position', 'vehicle', 'is_active', 'created_at')
     
     @classmethod
     def create(cls, full_name: str, position: str, vehicle: str = None):
-        doc_id = cls.table.insert({
+        doc_id = cls.insert(cls._document(full_name, position, vehicle))
+        return doc_id
+
+    @staticmethod
+    def _document(full_name: str, position: str, vehicle: str) -> dict:
+        return {
             'full_name': full_name,
             'position': position,
             'vehicle': vehicle,
             'is_active': True,
             'created_at': datetime.now().isoformat()
-        })
-        return doc_id
+        }
+
+    @classmethod
+    def import_csv(cls, path: str):
+        """Сотрудники из CSV (full_name, position, vehicle) одной пачкой.
+        Однофамильцы допустимы: повтором считается то же ФИО с той же должностью"""
+        documents, errors, seen = [], [], set()
+        for line, row in read_csv(path, required=('full_name', 'position')):
+            if not row['full_name'] or not row['position']:
+                errors.append((line, "пустые ФИО или должность"))
+                continue
+            key = (row['full_name'], row['position'])
+            if key in seen or any(
+                    doc['position'] == row['position'] for doc in cls.find_by('full_name', row['full_name'])):
+                errors.append((line, f"сотрудник {row['full_name']!r} ({row['position']}) уже есть"))
+                continue
+            seen.add(key)
+            documents.append(cls._document(row['full_name'], row['position'], vehicle_value(row)))
+        cls.insert_many(documents)
+        return len(documents), errors
 
     @classmethod
     def toggle_status(cls, doc_id: int):
@@ -129,54 +624,259 @@ class Employee(BaseModel):
 
 class Guest(BaseModel):
     table = db.table('guests')
+    indexes = ('qr_id', 'is_active')
+    pass_type = pass_token.GUEST
     
     @classmethod
-    def create_temp_pass(cls, days_valid: int):
-        qr_id = secrets.randbelow(10**10)
+    def create(cls, days_valid: int):
+        """Создаёт запись гостя без QR-кода"""
+        qr_id = cls.new_qr_id()
         expires_at = datetime.now() + timedelta(days=days_valid)
         
         # Вставляем запись и получаем ID документа
-        doc_id = cls.table.insert({
+        doc_id = cls.insert({
             'qr_id': qr_id,
             'expires_at': expires_at.isoformat(),
             'is_active': True,
-            'qr_code_path': None
+            'qr_payload': None,
+            'qr_code_path': None,
+            'qr_file_id': None,
+            'qr_document_file_id': None
         })
+        return doc_id, qr_id
+
+    @staticmethod
+    def qr_payload(guest: dict) -> str:
+        """Подписанный пропуск со сроком действия гостя"""
+        return pass_token.sign(pass_token.GUEST, guest['qr_id'], guest['expires_at'])
+
+    @staticmethod
+    def qr_path(doc_id: int) -> str:
+        return f'qrcodes/guest_{doc_id}.png'
+
+    @classmethod
+    def create_temp_pass(cls, days_valid: int):
+        doc_id, qr_id = cls.create(days_valid)
         
         # Генерируем QR-код
-        qr = qrcode.make(f"TEMP PASS ID: {qr_id}")
-        qr_path = f'qrcodes/guest_{doc_id}.png'
-        os.makedirs('qrcodes', exist_ok=True)  # Создаем папку, если её нет
-        qr.save(qr_path)
+        payload = cls.qr_payload(cls.get_by_id(doc_id))
+        qr_path = qr_disk_path(cls.qr_path(doc_id))
+        qr_service.get_png(qr_id, payload, qr_path)
         
-        # Обновляем запись с путём к QR-коду
-        cls.update(doc_id, {'qr_code_path': qr_path})
+        # Обновляем запись с данными QR-кода
+        cls.update(doc_id, qr_fields(payload, qr_path))
         
         return doc_id, qr_id  # Возвращаем оба значения!
-class AccessLog(BaseModel):
-    table = db.table('access_logs')
+
+    @classmethod
+    def toggle_status(cls, doc_id: int):
+        guest = cls.get_by_id(doc_id)
+        cls.update(doc_id, {'is_active': not guest['is_active']})
+
+    @classmethod
+    def purge_expired(cls, before: datetime):
+        """Удаляет гостей, чей срок истёк раньше before, и возвращает их записи"""
+        expired = [guest for guest in cls.get_all() if datetime.fromisoformat(guest['expires_at']) < before]
+        removed = set(cls.remove_many([guest.doc_id for guest in expired]))
+        expired = [guest for guest in expired if guest.doc_id in removed]
+        for guest in expired:
+            pass_token.set_revoked(cls.pass_type, guest['qr_id'], False)
+        return expired
+
+class AccessLog:
+    """Журнал проходов в сегментах access_logs/*.jsonl (см. access_log.py)"""
+    log = SegmentedLog(
+        ACCESS_LOG_DIR,
+        max_segment_bytes=int(float(os.getenv('ACCESS_LOG_SEGMENT_MB', '8')) * 1024 * 1024),
+        max_segment_age=float(os.getenv('ACCESS_LOG_SEGMENT_HOURS', '24')) * 3600
+    )
     
     @classmethod
     def log_entry(cls, user_type: str, user_id: int, status: str):
-        cls.table.insert({
+        cls.log.append({
             'user_type': user_type,
             'user_id': user_id,
             'timestamp': datetime.now().isoformat(),
             'status': status
         })
 
+    @classmethod
+    def log_entries(cls, entries: list):
+        """Пачка записей [(user_type, user_id, status)] одной дозаписью"""
+        timestamp = datetime.now().isoformat()
+        cls.log.append_many([{
+            'user_type': user_type,
+            'user_id': user_id,
+            'timestamp': timestamp,
+            'status': status
+        } for user_type, user_id, status in entries])
+
+    @classmethod
+    def tail(cls, count: int):
+        return cls.log.tail(count)
+
+    @classmethod
+    def get_all(cls):
+        return list(cls.log)
+
+    @classmethod
+    def query(cls, start: str, end: str, user_type: str = None, user_id: int = None, status: str = None):
+        """Записи за интервал [start, end] (ISO-строки) с необязательными фильтрами"""
+        for entry in cls.log.query(start, end):
+            if user_type is not None and entry['user_type'] != user_type:
+                continue
+            if user_id is not None and entry['user_id'] != user_id:
+                continue
+            if status is not None and entry['status'] != status:
+                continue
+            yield entry
+
+    @classmethod
+    def stats(cls, start: str, end: str, period: str = 'day', **filters):
+        """Число разрешённых и отклонённых проходов по дням или часам"""
+        # 2026-10-18 — день, 2026-10-18T09 — час
+        width = 13 if period == 'hour' else 10
+        counts = {}
+        for entry in cls.query(start, end, **filters):
+            bucket = counts.setdefault(entry['timestamp'][:width], {'разрешён': 0, 'отклонён': 0})
+            bucket[entry['status']] = bucket.get(entry['status'], 0) + 1
+        return counts
+
+    @classmethod
+    def export_csv(cls, path: str, start: str, end: str, **filters):
+        """Пишет выборку в CSV построчно и возвращает число строк"""
+        count = 0
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(['timestamp', 'user_type', 'user_id', 'status'])
+            for entry in cls.query(start, end, **filters):
+                writer.writerow([csv_safe(entry[field]) for field in ('timestamp', 'user_type', 'user_id', 'status')])
+                count += 1
+        return count
+
+    @classmethod
+    def archive(cls, before: str) -> int:
+        """Переносит записи старше before в архивы access_logs/archive"""
+        return cls.log.archive(before)
+
+    @classmethod
+    def migrate_from_table(cls):
+        """Переносит журнал из старой таблицы access_logs в сегменты.
+        Уже перенесённые записи (после падения или из другого процесса) пропускаются"""
+        table = db.table('access_logs')
+        entries = table.all()
+        if not entries:
+            return
+        cls.log.merge(dict(entry) for entry in entries)
+        table.truncate()
+
 class PendingRequest(BaseModel):
     table = db.table('pending_requests')
+    indexes = ('pass_id', 'admin_message_id')
     
     @classmethod
-    def create(cls, requester_id: int, pass_id: int, user_type: str):
-        return cls.table.insert({
+    def create(cls, requester_id: int, pass_id: int, user_type: str, expires_at: float = None,
+               summary: str = None):
+        return cls.insert({
             'requester_id': requester_id,
             'pass_id': pass_id,
             'user_type': user_type,
-            'timestamp': datetime.now().isoformat()
+            'summary': summary,  # строка запроса в сводке для администратора
+            'timestamp': datetime.now().isoformat(),
+            'expires_at': expires_at,  # unix-время, после которого запрос снимается
+            'admin_chat_id': None,
+            'admin_message_id': None
         })
     
     @classmethod
     def get_by_pass_id(cls, pass_id: int):
-        return cls.table.get(Query().pass_id == pass_id)
\ No newline at end of file
+        return cls.get_by('pass_id', pass_id)
+
+    @classmethod
+    def find_by_message(cls, message_id: int):
+        """Запросы, ещё ждущие решения в сводке с этим сообщением"""
+        return sorted(cls.find_by('admin_message_id', message_id), key=lambda r: r.doc_id)
+
+    @classmethod
+    def purge_dead(cls, before: float) -> int:
+        """Удаляет запросы, срок которых истёк раньше before (unix-время), —
+        их не снял реестр, например из-за падения процесса. У старых записей
+        без expires_at срок — сутки с момента создания"""
+        dead = []
+        for request in cls.get_all():
+            expires_at = request.get('expires_at')
+            if expires_at is None:
+                expires_at = datetime.fromisoformat(request['timestamp']).timestamp() + 24 * 3600
+            if expires_at < before:
+                dead.append(request.doc_id)
+        return len(cls.remove_many(dead))
+
+class Broadcast(BaseModel):
+    """Рассылки с курсором: после перезапуска продолжаются с места остановки"""
+    table = db.table('broadcasts')
+    indexes = ('status',)
+
+    @classmethod
+    def create(cls, text: str, admin_chat_id: int, status_message_id: int, total: int):
+        return cls.insert({
+            'text': text,
+            'admin_chat_id': admin_chat_id,
+            'status_message_id': status_message_id,
+            'status': 'running',
+            'cursor': 0,  # doc_id последнего обработанного пользователя
+            'total': total,
+            'delivered': 0,
+            'failed': 0,
+            'created_at': datetime.now().isoformat()
+        })
+
+    @classmethod
+    def get_unfinished(cls):
+        return cls.find_by('status', 'running')
+
+# Индексы живут только в памяти — собираем их из db.json при старте
+for model in (User, News, Employee, Guest, PendingRequest, Broadcast):
+    model.build_indexes()
+
+# Переносит только родительский процесс: дочерние (воркеры и пулы QR при spawn)
+# заново импортируют модуль, и TinyDB в них не должна ничего записывать
+if multiprocessing.parent_process() is None:
+    AccessLog.migrate_from_table()
+
+
+class PassRevocations:
+    """Заполняет pass_token.revoked заблокированными пропусками.
+    В одном процессе список поддерживают сами модели при смене is_active,
+    а изменения из других процессов подхватывает sync. Читаются только
+    записи с is_active = False по индексу, не вся таблица"""
+    _loaded_at = None
+    _version = None
+
+    @classmethod
+    def load(cls):
+        revoked = set()
+        for model in (User, Guest):
+            for doc in model.find_by('is_active', False):
+                if doc.get('qr_id') is not None:
+                    revoked.add((model.pass_type, doc['qr_id']))
+        # Одним присваиванием: verify() не должен видеть список пустым
+        pass_token.revoked = revoked
+        cls._loaded_at = time.monotonic()
+        cls._version = data_version()
+
+    @classmethod
+    def is_stale(cls, max_age: float) -> bool:
+        return cls._loaded_at is None or time.monotonic() - cls._loaded_at > max_age
+
+    @classmethod
+    def sync(cls, max_age: float):
+        """Перечитывает список не чаще раза в max_age секунд и только если БД меняли"""
+        if not cls.is_stale(max_age):
+            return
+        if cls._loaded_at is not None and data_version() == cls._version:
+            cls._loaded_at = time.monotonic()
+            return
+        cls.load()
+
+
+PassRevocations.load()
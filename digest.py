@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import zlib
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from pending import PendingRegistry
+from repository import Repository
+
+
+class ApprovalDigest:
+    """Сводка запросов на проход в чате администраторов.
+
+    Вместо сообщения на каждый скан запросы копятся window секунд и
+    уходят одним сообщением с кнопками по каждому запросу и «все сразу».
+    Пока в сводке есть место (max_items), новые запросы дописываются
+    в неё же. Содержимое сводки всегда строится из таблицы
+    pending_requests по admin_message_id, поэтому её может обновить любой
+    процесс-воркер и она переживает перезапуск."""
+
+    def __init__(self, bot: Bot, repo: Repository, pending: PendingRegistry, chat_id,
+                 window: float = 3, max_items: int = 20):
+        self.bot = bot
+        self.repo = repo
+        self.pending = pending
+        self.chat_id = chat_id
+        self.window = window
+        self.max_items = max_items
+        self._batch = []
+        self._flush_task = None
+        # Сводка, в которую дописываются новые запросы, и сколько в ней запросов
+        self._live_message_id = None
+        self._live_count = 0
+        self._locks = {}
+
+    def add(self, request):
+        """Ставит запрос в ближайшую сводку"""
+        self._batch.append(request.doc_id)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flush_task = None
+        batch, self._batch = self._batch, []
+        try:
+            await self._flush(batch)
+        except Exception as e:
+            logging.error(f"Ошибка отправки сводки запросов: {e}")
+
+    async def _flush(self, doc_ids: list):
+        # Запрос могли закрыть, пока он ждал отправки
+        doc_ids = [doc_id for doc_id in doc_ids if self.pending.get(doc_id) is not None]
+        while doc_ids:
+            if self._live_message_id is None or self._live_count >= self.max_items:
+                chunk, doc_ids = doc_ids[:self.max_items], doc_ids[self.max_items:]
+                text, keyboard = self.render([self.pending.get(doc_id) for doc_id in chunk])
+                sent = await self.bot.send_message(chat_id=self.chat_id, text=text, reply_markup=keyboard)
+                self._live_message_id, self._live_count = sent.message_id, len(chunk)
+                await self.pending.attach_to_message(chunk, self.chat_id, sent.message_id)
+            else:
+                room = self.max_items - self._live_count
+                chunk, doc_ids = doc_ids[:room], doc_ids[room:]
+                self._live_count += len(chunk)
+                await self.pending.attach_to_message(chunk, self.chat_id, self._live_message_id)
+                await self.refresh(self._live_message_id)
+
+    async def refresh(self, message_id: int):
+        """Перерисовывает сводку по запросам, которые ещё ждут решения"""
+        lock = self._locks.setdefault(message_id, asyncio.Lock())
+        async with lock:
+            requests = await self.repo.find_pending_by_message(message_id)
+            if requests:
+                text, keyboard = self.render(requests)
+            else:
+                text, keyboard = '✅ Все запросы из этой сводки обработаны', None
+                self._locks.pop(message_id, None)
+                if message_id == self._live_message_id:
+                    self._live_message_id = None
+            try:
+                await self.bot.edit_message_text(
+                    text=text, chat_id=self.chat_id, message_id=message_id, reply_markup=keyboard
+                )
+            except TelegramBadRequest as e:
+                # «message is not modified» — сводку уже перерисовал другой вызов
+                logging.debug(f"Сводка {message_id} не изменена: {e}")
+            except TelegramAPIError as e:
+                logging.error(f"Ошибка обновления сводки {message_id}: {e}")
+
+    @staticmethod
+    def fingerprint(requests: list) -> str:
+        """Короткий отпечаток набора запросов (влезает в callback_data)"""
+        doc_ids = ','.join(str(doc_id) for doc_id in sorted(request.doc_id for request in requests))
+        return f'{zlib.crc32(doc_ids.encode()):08x}'
+
+    @staticmethod
+    def render(requests: list):
+        lines = [f'🔔 Запросы на проход: {len(requests)}', '']
+        rows = []
+        for number, request in enumerate(requests, 1):
+            summary = request.get('summary') or f"QR-ID: {request['pass_id']}"
+            lines.append(f'{number}. {summary}')
+            rows.append([
+                InlineKeyboardButton(
+                    text=f'✅ {number}', callback_data=f"access_allow_{request['pass_id']}_{request.doc_id}"
+                ),
+                InlineKeyboardButton(
+                    text=f'❌ {number}', callback_data=f"access_deny_{request['pass_id']}_{request.doc_id}"
+                )
+            ])
+        if len(requests) > 1:
+            # Сводку определяет само сообщение с кнопкой, а отпечаток — какие запросы
+            # в ней были видны: дописанные после отрисовки кнопка не решит
+            version = ApprovalDigest.fingerprint(requests)
+            rows.append([
+                InlineKeyboardButton(text='✅ Подтвердить все', callback_data=f'digest_allow_{version}'),
+                InlineKeyboardButton(text='❌ Отклонить все', callback_data=f'digest_deny_{version}')
+            ])
+        return '\n'.join(lines), InlineKeyboardMarkup(inline_keyboard=rows)
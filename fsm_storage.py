@@ -0,0 +1,116 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+
+class SQLiteFSMStorage(BaseStorage):
+    """Хранилище состояний FSM в SQLite вместо MemoryStorage.
+
+    Начатая регистрация или новость переживает перезапуск бота: каждое
+    изменение сразу пишется в файл. Активные сессии (и отсутствие сессии —
+    этот вопрос задаёт каждое сообщение) лежат в LRU-кэше с TTL, так что
+    память ограничена cache_size записями при любом наплыве пользователей.
+    Сессии, которые не менялись дольше session_ttl, удаляются с диска."""
+
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, path: str, cache_size: int = 10_000, cache_ttl: float = 600,
+                 session_ttl: float = 7 * 24 * 3600):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.session_ttl = session_ttl
+        # ключ -> (state, data, время попадания в кэш)
+        self._cache = OrderedDict()
+        # Все обращения к файлу идут через один поток и не блокируют event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm')
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS fsm ('
+            'key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_fsm_updated_at ON fsm (updated_at)')
+        self._purge()
+        self._purged_at = time.time()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ':'.join(str(part) for part in (
+            key.bot_id, key.business_connection_id, key.chat_id,
+            key.user_id, key.thread_id, key.destiny
+        ))
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _load(self, key: str):
+        row = self._conn.execute('SELECT state, data FROM fsm WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _save(self, key: str, state, data: dict):
+        if state is None and not data:
+            # Пустая сессия ничем не отличается от отсутствующей — строку не храним
+            self._conn.execute('DELETE FROM fsm WHERE key = ?', (key,))
+        else:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)',
+                (key, state, json.dumps(data, ensure_ascii=False), time.time())
+            )
+
+    def _purge(self):
+        self._conn.execute('DELETE FROM fsm WHERE updated_at < ?', (time.time() - self.session_ttl,))
+
+    def _remember(self, key: str, state, data: dict):
+        self._cache[key] = (state, data, time.monotonic())
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _get(self, key: str):
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[2] < self.cache_ttl:
+            self._cache.move_to_end(key)
+            return cached[0], cached[1]
+        state, data = await self._run(self._load, key)
+        self._remember(key, state, data)
+        return state, data
+
+    async def _set(self, key: str, state, data: dict):
+        self._remember(key, state, data)
+        await self._run(self._save, key, state, data)
+        if time.time() - self._purged_at > self.PURGE_INTERVAL:
+            self._purged_at = time.time()
+            await self._run(self._purge)
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        key = self._key(key)
+        _, data = await self._get(key)
+        await self._set(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey):
+        state, _ = await self._get(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        key = self._key(key)
+        state, _ = await self._get(key)
+        await self._set(key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        _, data = await self._get(self._key(key))
+        return dict(data)
+
+    async def close(self) -> None:
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+        self._cache.clear()
@@ -0,0 +1,282 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiohttp import web
+
+# Границы корзин гистограмм в секундах
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labels, extra: str = ''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def series(self):
+        with self._lock:
+            return dict(self._values)
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.series().items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: наблюдение — бинарный поиск
+    и пара сложений под блокировкой, поэтому её можно держать включённой всегда"""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма, количество]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def series(self):
+        with self._lock:
+            return {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+
+    def quantile(self, q: float, counts: list) -> float:
+        """Оценка квантиля по корзинам, как histogram_quantile в Prometheus"""
+        count = sum(counts)
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{suffix} {total}')
+            lines.append(f'{self.name}_count{suffix} {count}')
+        return lines
+
+
+HANDLER_SECONDS = Histogram(
+    'bot_handler_seconds', 'Время работы обработчика', ('handler', 'outcome')
+)
+UPDATES = Counter(
+    'bot_updates_total', 'Обработанные обновления по исходу', ('type', 'outcome')
+)
+DB_SECONDS = Histogram(
+    'bot_db_operation_seconds', 'Время операции с БД в рабочем потоке', ('operation',)
+)
+DB_ERRORS = Counter(
+    'bot_db_operation_errors_total', 'Операции с БД, завершившиеся исключением', ('operation',)
+)
+QR_RENDER_SECONDS = Histogram(
+    'bot_qr_render_seconds', 'Время отрисовки одного QR-кода в PNG'
+)
+QR_CACHE = Counter(
+    'bot_qr_cache_total', 'Обращения к кэшу PNG', ('result',)
+)
+QR_DECODE_SECONDS = Histogram(
+    'bot_qr_decode_seconds', 'Время распознавания QR-кода на фото', ('outcome',)
+)
+THROTTLED = Counter(
+    'bot_throttled_total', 'Команды, отброшенные ограничением частоты', ('command',)
+)
+REGISTRY = (
+    HANDLER_SECONDS, UPDATES, DB_SECONDS, DB_ERRORS, QR_RENDER_SECONDS, QR_CACHE, QR_DECODE_SECONDS, THROTTLED
+)
+
+
+def exposition() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.exposition()
+    return '\n'.join(lines) + '\n'
+
+
+def operation_name(func) -> str:
+    # Для classmethod моделей — 'User.get_by', а не 'BaseModel.get_by'
+    owner = getattr(func, '__self__', None)
+    if isinstance(owner, type):
+        return f'{owner.__name__}.{func.__name__}'
+    return getattr(func, '__qualname__', repr(func))
+
+
+def timed_operation(func, *args, **kwargs):
+    """Вызывает операцию БД и записывает её время (выполняется в потоке БД)"""
+    name = operation_name(func)
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        DB_ERRORS.inc(name)
+        raise
+    finally:
+        DB_SECONDS.observe(time.perf_counter() - started, name)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: считает обновления по исходу,
+    в том числе те, для которых не нашлось обработчика"""
+
+    async def __call__(self, handler, event, data):
+        event_type = event.event_type
+        try:
+            result = await handler(event, data)
+        except Exception:
+            UPDATES.inc(event_type, 'error')
+            raise
+        UPDATES.inc(event_type, 'unhandled' if result is UNHANDLED else 'handled')
+        return result
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время каждого обработчика и его исход"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = await handler(event, data)
+            outcome = 'ok'
+            return result
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name, outcome)
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics для Prometheus (по умолчанию только на localhost)"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        if not self.port:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(text=exposition(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+
+def summary(top: int = 5) -> str:
+    """Краткая сводка для команды /stats"""
+    lines = ['<b>⏱ Обработчики</b> (вызовы, ошибки, среднее, p95):']
+    handlers = {}
+    for (name, outcome), (counts, total, count) in HANDLER_SECONDS.series().items():
+        stats = handlers.setdefault(name, {'counts': [0] * len(counts), 'total': 0.0, 'count': 0, 'errors': 0})
+        stats['counts'] = [a + b for a, b in zip(stats['counts'], counts)]
+        stats['total'] += total
+        stats['count'] += count
+        if outcome == 'error':
+            stats['errors'] += count
+    for name, stats in sorted(handlers.items(), key=lambda item: -item[1]['total']):
+        p95 = HANDLER_SECONDS.quantile(0.95, stats['counts'])
+        lines.append(
+            f"{name}: {stats['count']}, {stats['errors']}, "
+            f"{stats['total'] / stats['count'] * 1000:.1f} мс, {p95 * 1000:.1f} мс"
+        )
+    if not handlers:
+        lines.append('нет данных')
+
+    lines.append(f'\n<b>🗄 Операции БД</b> (топ-{top} по суммарному времени):')
+    operations = sorted(DB_SECONDS.series().items(), key=lambda item: -item[1][1])[:top]
+    for (name,), (counts, total, count) in operations:
+        lines.append(
+            f"{name}: {count}, {total / count * 1000:.2f} мс в среднем, "
+            f"p95 {DB_SECONDS.quantile(0.95, counts) * 1000:.2f} мс"
+        )
+    if not operations:
+        lines.append('нет данных')
+
+    renders = QR_RENDER_SECONDS.series().get(())
+    hits, misses = QR_CACHE.value('hit'), QR_CACHE.value('miss')
+    lines.append('\n<b>🔳 QR-коды</b>')
+    if renders:
+        lines.append(f'Отрисовано: {renders[2]}, в среднем {renders[1] / renders[2] * 1000:.1f} мс')
+    if hits + misses:
+        lines.append(f'Попадания в кэш: {hits / (hits + misses) * 100:.0f}% из {hits + misses}')
+    decodes = QR_DECODE_SECONDS.series()
+    if decodes:
+        counts = [sum(column) for column in zip(*(series[0] for series in decodes.values()))]
+        found = decodes.get(('found',), (None, 0, 0))[2]
+        lines.append(
+            f'Распознано с фото: {found} из {sum(counts)}, '
+            f'p95 {QR_DECODE_SECONDS.quantile(0.95, counts) * 1000:.0f} мс'
+        )
+    throttled = THROTTLED.series()
+    if throttled:
+        lines.append('\n<b>🚦 Отброшено ограничением частоты</b>')
+        lines += [f'/{command}: {count:.0f}' for (command,), count in sorted(throttled.items())]
+    return '\n'.join(lines)
@@ -0,0 +1,35 @@
+"""Одноразовый перенос db.json в SQLite.
+
+    python migrate_db.py [db.json] [db.sqlite3]
+
+После переноса запускайте бота с DB_BACKEND=sqlite.
+"""
+import json
+import os
+import sys
+
+from sqlite_db import SQLiteDatabase
+
+
+def migrate(json_path: str, sqlite_path: str):
+    with open(json_path, encoding='utf-8') as f:
+        tables = json.load(f)
+
+    target = SQLiteDatabase(sqlite_path)
+    try:
+        for name, documents in tables.items():
+            table = target.table(name)
+            if len(table):
+                print(f"Пропуск {name}: таблица в {sqlite_path} уже не пуста")
+                continue
+            # doc_id сохраняем — на них ссылаются /block_pass и пути к QR
+            table.import_documents(documents)
+            print(f"{name}: перенесено {len(documents)} записей")
+    finally:
+        target.close()
+
+
+if __name__ == '__main__':
+    json_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv('DB_PATH', 'db.json')
+    sqlite_path = sys.argv[2] if len(sys.argv) > 2 else os.getenv('SQLITE_PATH', 'db.sqlite3')
+    migrate(json_path, sqlite_path)
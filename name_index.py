@@ -0,0 +1,168 @@
+import heapq
+from bisect import bisect_left
+import re
+from array import array
+from collections import Counter
+from operator import itemgetter
+
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize(text: str) -> str:
+    """Регистр, ё/е, знаки препинания и лишние пробелы не влияют на поиск"""
+    return ' '.join(_NON_WORD.sub(' ', text.lower().replace('ё', 'е')).split())
+
+
+def trigrams(text: str) -> set:
+    grams = set()
+    for token in text.split():
+        padded = f'  {token} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NameIndex:
+    """Инвертированный индекс по триграммам нормализованных имён.
+
+    Индексируются различные имена, а не записи: однофамильцы с одинаковым
+    ФИО делят одну запись индекса. Для каждой триграммы хранится массив
+    номеров имён (4 байта на запись), поэтому 100 тыс. ФИО занимают единицы
+    мегабайт. Набор триграмм имени не меняется, поэтому при удалении и
+    переименовании doc_id просто переходит к другому имени, а имя без
+    записей остаётся в массивах, пока таких не наберётся много.
+
+    Поиск ранжирует по доле совпавших триграмм запроса и по сходству
+    имени целиком (коэффициент Дайса) с учётом всех триграмм запроса."""
+
+    # Какая доля имён в массивах может быть без записей до пересборки
+    STALE_RATIO = 0.25
+
+    def __init__(self):
+        # doc_id -> номер имени
+        self._doc_keys = {}
+        # имя -> номер; по номеру — имя, число его триграмм и записи с этим именем
+        self._keys = {}
+        self._names = []
+        self._sizes = []
+        self._docs = []
+        self._postings = {}
+        self._stale = 0
+
+    def __len__(self):
+        return len(self._doc_keys)
+
+    def name(self, doc_id: int):
+        key = self._doc_keys.get(doc_id)
+        return None if key is None else self._names[key]
+
+    def clear(self):
+        self.__init__()
+
+    def add(self, doc_id: int, name: str):
+        """Добавляет или переименовывает запись"""
+        name = normalize(name or '')
+        if self.name(doc_id) == name:
+            return
+        # До поиска номера имени: удаление может пересобрать индекс
+        self.remove(doc_id)
+        key = self._keys.get(name)
+        if key is None:
+            key = self._keys[name] = len(self._names)
+            grams = trigrams(name)
+            self._names.append(name)
+            self._sizes.append(len(grams))
+            self._docs.append({})
+            for gram in grams:
+                posting = self._postings.get(gram)
+                if posting is None:
+                    posting = self._postings[gram] = array('I')
+                posting.append(key)
+        elif not self._docs[key]:
+            # Имя снова с записями
+            self._stale -= 1
+        self._docs[key][doc_id] = None
+        self._doc_keys[doc_id] = key
+
+    def remove(self, doc_id: int):
+        key = self._doc_keys.pop(doc_id, None)
+        if key is None:
+            return
+        docs = self._docs[key]
+        docs.pop(doc_id, None)
+        if not docs:
+            self._stale += 1
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if self._stale > 1000 and self._stale > len(self._names) * self.STALE_RATIO:
+            doc_names = [(doc_id, self._names[key]) for doc_id, key in self._doc_keys.items()]
+            self.clear()
+            for doc_id, name in doc_names:
+                self.add(doc_id, name)
+
+    def search(self, query: str, limit: int = 10, min_coverage: float = 0.5):
+        """[(doc_id, оценка от 0 до 1)] по убыванию оценки"""
+        query_grams = trigrams(normalize(query))
+        if not query_grams:
+            return []
+        size = len(query_grams)
+        min_shared = min_coverage * size
+        sizes, docs = self._sizes, self._docs
+
+        def bound(shared):
+            # Наибольшая оценка при shared общих триграммах: в имени их не меньше shared
+            shared = min(shared, size)
+            return shared / size + 2 * shared / (size + shared)
+
+        def cutoff(counts):
+            # Точная оценка limit-го из лучших пока имён (в каждом хотя бы одна запись):
+            # имя с меньшей оценкой в выдачу уже не попадёт
+            scores = []
+            for key, _ in heapq.nlargest(limit * 2, counts.items(), key=itemgetter(1)):
+                if docs[key]:
+                    name_grams = trigrams(self._names[key])
+                    shared = len(query_grams & name_grams)
+                    scores.append(shared / size + 2 * shared / (size + len(name_grams)))
+            return heapq.nlargest(limit, scores)[-1] if len(scores) >= limit else None
+
+        # Массивы от редких триграмм к частым. Имя, которого нет в пройденных массивах,
+        # наберёт не больше remaining триграмм; если этого не хватает, чтобы обойти
+        # limit-й результат, оставшиеся частые массивы целиком не считаем, а ищем в них
+        # немногих кандидатов двоичным поиском (номера имён в массивах возрастают).
+        # Отсечение точное: имя с оценкой выше limit-й не теряется
+        postings = sorted(
+            (self._postings[gram] for gram in query_grams if gram in self._postings), key=len
+        )
+        counts = Counter()
+        for done, posting in enumerate(postings):
+            remaining = len(postings) - done
+            # Проверка порога окупается, только если массив не намного короче счётчика
+            if len(counts) >= limit and 4 * len(posting) >= len(counts):
+                threshold = cutoff(counts)
+                if threshold is not None and bound(remaining) < threshold:
+                    need = min_shared - remaining
+                    while bound(need + remaining) < threshold:
+                        need += 1
+                    found = {key: n for key, n in counts.items() if n >= need}
+                    # Двоичный поиск раз в 20 дороже подсчёта — только для немногих
+                    if len(found) * remaining * 20 < sum(map(len, postings[done:])):
+                        counts = found
+                        for rest in postings[done:]:
+                            end = len(rest)
+                            for key in counts:
+                                i = bisect_left(rest, key)
+                                if i < end and rest[i] == key:
+                                    counts[key] += 1
+                        break
+            counts.update(posting)
+
+        scored = [
+            (shared / size + 2 * shared / (size + sizes[key]), key)
+            for key, shared in counts.items()
+            if shared >= min_shared and docs[key]
+        ]
+        # У каждого имени хотя бы одна запись, так что limit имён хватит на limit записей
+        results = []
+        for value, key in heapq.nlargest(limit, scored):
+            results += [(doc_id, value / 2) for doc_id in sorted(docs[key])]
+        return results[:limit]
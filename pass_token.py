@@ -0,0 +1,105 @@
+"""Подписанные данные QR-кода пропуска.
+
+Формат: P1.<тип>.<qr_id>.<срок>.<подпись>
+  тип     — U (зарегистрированный пользователь) или G (гость)
+  срок    — unix-время окончания в base36, 0 — бессрочно
+  подпись — первые 12 байт HMAC-SHA256 от остальной строки в base64url
+
+Подделать пропуск, зная только qr_id, нельзя, а подпись и срок
+проверяются без обращения к БД. Отозванные пропуска лежат в множестве
+в памяти, его поддерживают модели в database.py."""
+import base64
+import hashlib
+import hmac
+import os
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PREFIX = 'P1.'
+USER = 'U'
+GUEST = 'G'
+SIGNATURE_BYTES = 12
+
+# (тип, qr_id) заблокированных пропусков
+revoked = set()
+
+
+class InvalidPass(ValueError):
+    """Пропуск не прошёл проверку; reason — format, signature, expired или revoked"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _secret() -> bytes:
+    # Без QR_SECRET ключ выводится из токена бота: при смене токена старые QR перестанут проходить
+    secret = os.getenv('QR_SECRET')
+    if secret:
+        return secret.encode()
+    token = os.getenv('BOT_TOKEN')
+    if not token:
+        raise RuntimeError('Для подписи QR-кодов нужен QR_SECRET или BOT_TOKEN')
+    return hmac.new(token.encode(), b'qr-pass', hashlib.sha256).digest()
+
+
+def _signature(body: str) -> str:
+    digest = hmac.new(_secret(), body.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def _base36(number: int) -> str:
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    text = ''
+    while number:
+        number, rest = divmod(number, 36)
+        text = digits[rest] + text
+    return text or '0'
+
+
+def sign(kind: str, qr_id: int, expires_at: str = None) -> str:
+    """Данные для QR-кода; expires_at — срок в ISO-формате, как в записи гостя"""
+    expires = int(datetime.fromisoformat(expires_at).timestamp()) if expires_at else 0
+    body = f'{PREFIX}{kind}.{qr_id}.{_base36(expires)}'
+    return f'{body}.{_signature(body)}'
+
+
+def verify(payload: str, now: float = None):
+    """Возвращает (тип, qr_id, срок в unix-времени или None) или бросает InvalidPass"""
+    payload = payload.strip()
+    # Подпись сравнивается побайтно, а int() понял бы и не-ASCII цифры —
+    # набранные вручную буквы отсекаем сразу
+    if not payload.isascii():
+        raise InvalidPass('format')
+    parts = payload.split('.')
+    if len(parts) != 5 or f'{parts[0]}.' != PREFIX or parts[1] not in (USER, GUEST):
+        raise InvalidPass('format')
+    try:
+        qr_id = int(parts[2])
+        expires = int(parts[3], 36)
+    except ValueError:
+        raise InvalidPass('format')
+
+    body = '.'.join(parts[:4])
+    if not hmac.compare_digest(parts[4].encode(), _signature(body).encode()):
+        raise InvalidPass('signature')
+    if expires and expires < (now if now is not None else time.time()):
+        raise InvalidPass('expired')
+    if (parts[1], qr_id) in revoked:
+        raise InvalidPass('revoked')
+    return parts[1], qr_id, expires or None
+
+
+def is_signed(payload: str) -> bool:
+    return payload.strip().startswith(PREFIX)
+
+
+def set_revoked(kind: str, qr_id: int, is_revoked: bool):
+    if is_revoked:
+        revoked.add((kind, qr_id))
+    else:
+        revoked.discard((kind, qr_id))
@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import logging
+import time
+
+from repository import Repository
+
+
+class PendingRegistry:
+    """Открытые запросы на проход.
+
+    Все запросы держатся в памяти с ключами по doc_id, pass_id и паре
+    (requester_id, pass_id), таблица pending_requests — копия
+    на случай перезапуска. Повторный скан того же пропуска тем же
+    человеком не создаёт новый запрос. Неотвеченные запросы истекают
+    через ttl секунд: сроки лежат в куче, и фоновая задача просыпается
+    ровно к ближайшему из них."""
+
+    def __init__(self, repo: Repository, ttl: float = 600, on_expire=None):
+        self.repo = repo
+        self.ttl = ttl
+        # async-функция, которая получает истёкший запрос (правит сообщение админу)
+        self.on_expire = on_expire
+        self._requests = {}
+        self._by_pass = {}
+        self._by_requester = {}
+        # (requester_id, pass_id) -> [замок, число ждущих], пока запрос создаётся
+        self._opening = {}
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        for request in await self.repo.get_all_pending_requests():
+            if request.get('expires_at') is None:
+                # Запросы старых версий без срока получают полный ttl с момента запуска
+                request['expires_at'] = time.time() + self.ttl
+            self._add(request)
+        self._task = asyncio.create_task(self._expire_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def _add(self, request):
+        doc_id = request.doc_id
+        self._requests[doc_id] = request
+        self._by_pass.setdefault(request['pass_id'], {})[doc_id] = None
+        self._by_requester[(request['requester_id'], request['pass_id'])] = doc_id
+        heapq.heappush(self._heap, (request['expires_at'], doc_id))
+        if self._heap[0][1] == doc_id:
+            # Новый запрос истекает раньше всех — будим задачу, чтобы пересчитала сон
+            self._wakeup.set()
+
+    def _discard(self, doc_id: int):
+        request = self._requests.pop(doc_id, None)
+        if request is None:
+            return None
+        doc_ids = self._by_pass.get(request['pass_id'], {})
+        doc_ids.pop(doc_id, None)
+        if not doc_ids:
+            self._by_pass.pop(request['pass_id'], None)
+        self._by_requester.pop((request['requester_id'], request['pass_id']), None)
+        return request
+
+    async def open(self, requester_id: int, pass_id: int, user_type: str, summary: str = None):
+        """Возвращает (запрос, True) для нового запроса или (запрос, False),
+        если такой же запрос уже ждёт ответа администратора"""
+        # Пара занята до конца создания: второй скан, пришедший, пока первый
+        # ждёт БД, дождётся его и получит тот же запрос. Если создание упадёт,
+        # замок всё равно освободится
+        key = (requester_id, pass_id)
+        opening = self._opening.setdefault(key, [asyncio.Lock(), 0])
+        opening[1] += 1
+        try:
+            async with opening[0]:
+                return await self._open(requester_id, pass_id, user_type, summary)
+        finally:
+            opening[1] -= 1
+            if not opening[1]:
+                del self._opening[key]
+
+    async def _open(self, requester_id: int, pass_id: int, user_type: str, summary: str):
+        doc_id = self._by_requester.get((requester_id, pass_id))
+        if doc_id is not None:
+            # При нескольких воркерах решение администратора мог обработать другой
+            # процесс: запрос ещё открыт, только если его строка осталась в БД
+            stored = await self.repo.get_pending_request(doc_id)
+            if stored is not None:
+                # Пока ждали БД, запрос могли закрыть и в этом процессе
+                return self._requests.get(doc_id, stored), False
+            self._discard(doc_id)
+
+        expires_at = time.time() + self.ttl
+        request = await self.repo.create_pending_request(requester_id, pass_id, user_type, expires_at, summary)
+        self._add(request)
+        return request, True
+
+    async def attach_to_message(self, doc_ids: list, chat_id: int, message_id: int):
+        """Запоминает сообщение админу (сводку), в котором показаны запросы"""
+        fields = {'admin_chat_id': chat_id, 'admin_message_id': message_id}
+        updates = {}
+        for doc_id in doc_ids:
+            request = self._requests.get(doc_id)
+            if request is not None:
+                request.update(fields)
+                updates[doc_id] = fields
+        await self.repo.update_pending_requests(updates)
+
+    def get(self, doc_id: int):
+        return self._requests.get(doc_id)
+
+    def get_by_pass_id(self, pass_id: int):
+        doc_ids = self._by_pass.get(pass_id)
+        if not doc_ids:
+            return None
+        return self._requests[next(iter(doc_ids))]
+
+    def find_by_pass_id(self, pass_id: int):
+        return [self._requests[doc_id] for doc_id in self._by_pass.get(pass_id, ())]
+
+    async def fetch_by_pass_id(self, pass_id: int):
+        """Открытые запросы по пропуску из БД, включая созданные другими воркерами.
+        Записи в памяти, строк которых в БД уже нет, заодно снимаются"""
+        requests = await self.repo.find_pending_by_pass_id(pass_id)
+        alive = {request.doc_id for request in requests}
+        for doc_id in list(self._by_pass.get(pass_id, ())):
+            if doc_id not in alive:
+                self._discard(doc_id)
+        return requests
+
+    async def close(self, doc_id: int):
+        """Убирает запрос после решения администратора. Возвращает запрос, только
+        если его закрыл именно этот вызов: при нескольких процессах-воркерах
+        запрос живёт в памяти одного из них, а кто успел первым, решает удаление из БД"""
+        request = self._discard(doc_id)
+        if request is None:
+            request = await self.repo.get_pending_request(doc_id)
+            if request is None:
+                return None
+        if not await self.repo.remove_pending_request(doc_id):
+            return None
+        return request
+
+    async def close_many(self, doc_ids: list):
+        """Пакетный close: одна операция с БД, возвращает закрытые этим вызовом запросы"""
+        requests = {}
+        for doc_id in doc_ids:
+            request = self._discard(doc_id) or await self.repo.get_pending_request(doc_id)
+            if request is not None:
+                requests[doc_id] = request
+        removed = await self.repo.remove_pending_requests(list(requests))
+        return [requests[doc_id] for doc_id in removed]
+
+    async def _expire_loop(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            expires_at, doc_id = self._heap[0]
+            delay = expires_at - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            # В куче могут остаться записи уже закрытых запросов — их просто пропускаем
+            if doc_id in self._requests:
+                await self.expire(doc_id)
+
+    async def expire(self, doc_id: int):
+        """Снимает запрос без решения администратора"""
+        request = await self.close(doc_id)
+        if request is None:
+            return
+        logging.info(f"Запрос {doc_id} на пропуск {request['pass_id']} истёк")
+        if self.on_expire:
+            try:
+                await self.on_expire(request)
+            except Exception as e:
+                logging.error(f"Ошибка обработки истёкшего запроса {doc_id}: {e}")
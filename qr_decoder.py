@@ -0,0 +1,129 @@
+"""Распознавание QR-кода пропуска на фотографии.
+
+Картинка переводится в оттенки серого и уменьшается до max_side по
+большей стороне — этого хватает для QR на пропуске и держит время
+распознавания в пределах бюджета. Само распознавание (qr_images.py)
+идёт в пуле процессов, чтобы не блокировать event loop.
+
+Нужен OpenCV (pip install opencv-python-headless); без него бот
+принимает только введённые вручную коды. Проверка без Telegram —
+на PNG из User.generate_qr или /bulk_qr:
+
+    python qr_decoder.py qrcodes/user_1.png
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from qr_images import available, decode_image, warm_up
+
+# Номер из старых QR-кодов: «ID: 123» у пользователей и «TEMP PASS ID: 123» у гостей
+LEGACY_ID = re.compile(r'ID:\s*(\d+)')
+
+
+def pass_code(text: str):
+    """Код для /scan_pass из содержимого QR: подписанный пропуск или номер старого"""
+    text = text.strip()
+    if text.startswith('P1.'):
+        return text
+    match = LEGACY_ID.search(text)
+    return match.group(1) if match else None
+
+
+class QRDecoder:
+    """Ограниченный пул распознавания: не больше workers процессов и
+    queue_size ожидающих фото, чтобы наплыв снимков не копил память.
+    Распознавание дольше timeout секунд считается неудачным, но место
+    в очереди освобождается, только когда процесс действительно закончил"""
+
+    def __init__(self, workers: int = 2, queue_size: int = 20, max_side: int = 800, timeout: float = 2.0):
+        self.workers = workers
+        self.max_side = max_side
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(workers + queue_size)
+        # Пул создаёт start() (или первое фото), без OpenCV процессы не нужны
+        self._pool = None
+
+    def busy(self) -> bool:
+        return self._slots.locked()
+
+    def _ensure_pool(self):
+        if self._pool is None:
+            # spawn, а не fork: у родителя уже работают потоки БД и QR,
+            # и захваченные ими блокировки достались бы дочернему процессу
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+
+    def start(self):
+        """Запускает процессы пула заранее и не ждёт их: по задаче на процесс,
+        чтобы каждый уже импортировал OpenCV до первого фото"""
+        if not available():
+            return
+        self._ensure_pool()
+        for _ in range(self.workers):
+            self._pool.submit(warm_up)
+
+    async def decode(self, data: bytes):
+        """Текст QR-кода или None, если код не найден или не успели за timeout"""
+        self._ensure_pool()
+        loop = asyncio.get_running_loop()
+        await self._slots.acquire()
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            job = loop.run_in_executor(self._pool, decode_image, data, self.max_side)
+        except BaseException:
+            self._slots.release()
+            raise
+        job.add_done_callback(self._finished)
+        try:
+            # shield: по таймауту перестаём ждать, но задача в пуле держит место до конца
+            text = await asyncio.wait_for(asyncio.shield(job), self.timeout)
+            outcome = 'found' if text else 'not_found'
+            return text
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            logging.warning(f"Распознавание QR не уложилось в {self.timeout} с")
+            return None
+        except BrokenProcessPool as e:
+            # Процесс пула упал — следующее фото получит новый пул
+            logging.error(f"Пул распознавания QR сломан, пересоздаём: {e}")
+            self.close()
+            return None
+        except Exception as e:
+            logging.error(f"Ошибка распознавания QR: {e}")
+            return None
+        finally:
+            metrics.QR_DECODE_SECONDS.observe(time.perf_counter() - started, outcome)
+
+    def _finished(self, job):
+        self._slots.release()
+        # Результат задачи, которую перестали ждать, забираем, чтобы не было
+        # предупреждения о непрочитанном исключении
+        if not job.cancelled():
+            job.exception()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+if __name__ == '__main__':
+    if not available():
+        sys.exit('Нужен OpenCV: pip install opencv-python-headless')
+    max_side = int(os.getenv('QR_DECODE_MAX_SIDE', '800'))
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            data = f.read()
+        started = time.perf_counter()
+        text = decode_image(data, max_side)
+        print(f'{path}: {(time.perf_counter() - started) * 1000:.1f} мс -> {text!r}')
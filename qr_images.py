@@ -0,0 +1,45 @@
+"""Картинки QR-кодов для процессов-пулов.
+
+Функции отсюда выполняются в процессах, запущенных через spawn:
+каждый такой процесс импортирует только этот модуль (PIL, qrcode и
+необязательный OpenCV), а не бота с его БД, метриками и aiogram,
+поэтому стартует за доли секунды и почти не занимает памяти."""
+import io
+
+import qrcode
+from PIL import Image
+
+try:
+    import cv2
+    import numpy
+except ImportError:  # OpenCV — необязательная зависимость
+    cv2 = None
+
+
+def available() -> bool:
+    return cv2 is not None
+
+
+def render_png(data: str) -> bytes:
+    """Рисует QR-код и возвращает PNG в виде байтов"""
+    buffer = io.BytesIO()
+    qrcode.make(data).save(buffer)
+    return buffer.getvalue()
+
+
+def decode_image(data: bytes, max_side: int = 800):
+    """Текст первого найденного QR-кода или None"""
+    image = Image.open(io.BytesIO(data))
+    image.draft('L', (max_side, max_side))  # JPEG сразу декодируется в уменьшенном виде
+    image = image.convert('L')
+    image.thumbnail((max_side, max_side))
+    # Тихая зона вокруг кода могла обрезаться при кадрировании фото
+    framed = Image.new('L', (image.width + 32, image.height + 32), 255)
+    framed.paste(image, (16, 16))
+    text, _, _ = cv2.QRCodeDetector().detectAndDecode(numpy.asarray(framed))
+    return text or None
+
+
+def warm_up() -> bool:
+    """Пустая задача: процесс пула импортирует модуль и готов к работе"""
+    return available()
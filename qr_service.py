@@ -0,0 +1,127 @@
+import hashlib
+import io
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+import metrics
+import qr_images
+
+load_dotenv()
+
+# Сохранять ли PNG в qrcodes/ (по умолчанию картинки живут только в памяти)
+QR_SAVE_TO_DISK = os.getenv('QR_SAVE_TO_DISK', '0') == '1'
+QR_CACHE_MB = float(os.getenv('QR_CACHE_MB', '32'))
+
+
+def render_png(data: str) -> bytes:
+    """Рисует QR-код и возвращает PNG в виде байтов"""
+    with metrics.QR_RENDER_SECONDS.time():
+        return qr_images.render_png(data)
+
+
+class QRCache:
+    """LRU-кэш PNG, ограниченный суммарным размером картинок.
+    Ключ — qr_id и хэш содержимого, чтобы новый payload не отдавал старую картинку"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(qr_id: int, payload: str):
+        return qr_id, hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            png = self._items.get(key)
+            if png is not None:
+                self._items.move_to_end(key)
+            return png
+
+    def put(self, key, png: bytes):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = png
+            self._size += len(png)
+            while self._size > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def discard(self, qr_id: int):
+        with self._lock:
+            for key in [k for k in self._items if k[0] == qr_id]:
+                self._size -= len(self._items.pop(key))
+
+
+cache = QRCache(max_bytes=int(QR_CACHE_MB * 1024 * 1024))
+
+
+def get_png(qr_id: int, payload: str, path: str = None) -> bytes:
+    """PNG для пропуска: из кэша, с диска (старые записи без payload) или новой отрисовкой"""
+    if payload is None:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    key = QRCache.key(qr_id, payload)
+    png = cache.get(key)
+    metrics.QR_CACHE.inc('miss' if png is None else 'hit')
+    if png is None:
+        png = render_png(payload)
+        cache.put(key, png)
+        if path and QR_SAVE_TO_DISK:
+            save_png(path, png)
+    return png
+
+
+def save_png(path: str, png: bytes):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(png)
+
+
+# Telegram принимает от бота документы до 50 МБ, запас — на заголовки ZIP
+MAX_ARCHIVE_BYTES = 45 * 1024 * 1024
+
+
+def build_zip(files: dict, summary: str) -> bytes:
+    """ZIP-архив из {имя файла: PNG} и текстовой сводки"""
+    buffer = io.BytesIO()
+    # PNG уже сжат, поэтому файлы кладём без повторного сжатия
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name, png in files.items():
+            archive.writestr(name, png)
+        archive.writestr('summary.txt', summary, compress_type=zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+def build_zips(files: dict, summary: str, max_bytes: int = MAX_ARCHIVE_BYTES) -> list:
+    """Один или несколько ZIP-архивов, каждый не больше max_bytes"""
+    parts, part, size = [], {}, 0
+    for name, png in files.items():
+        # Локальный и центральный заголовки: по ~50 байт и имя файла дважды
+        entry = len(png) + 100 + 2 * len(name.encode('utf-8'))
+        if part and size + entry > max_bytes - len(summary.encode('utf-8')) - 1024:
+            parts.append(part)
+            part, size = {}, 0
+        part[name] = png
+        size += entry
+    parts.append(part)
+    if len(parts) == 1:
+        return [build_zip(parts[0], summary)]
+    return [
+        build_zip(part, f"{summary}\nАрхив {number} из {len(parts)}\n")
+        for number, part in enumerate(parts, 1)
+    ]
+
+
+def safe_filename(name: str) -> str:
+    return re.sub(r'[^\w.-]+', '_', name).strip('_') or 'qr'
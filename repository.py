@@ -0,0 +1,280 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+import database as db
+import metrics
+import qr_images
+import qr_service
+
+
+class Repository:
+    """Асинхронный доступ к моделям database.py.
+
+    Все обращения к БД идут через один поток: TinyDB не потокобезопасна,
+    а так записи выполняются строго по очереди и не блокируют event loop.
+    Отрисовка QR-кодов выполняется в отдельном ограниченном пуле,
+    готовые PNG отдаются из LRU-кэша qr_service."""
+
+    def __init__(self, qr_workers: int = 2, bulk_workers: int = None):
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        self._qr_executor = ThreadPoolExecutor(max_workers=qr_workers, thread_name_prefix='qr')
+        # Долгие выборки по журналу не должны задерживать очередь записей в БД
+        self._report_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reports')
+        # Пул процессов для массового выпуска QR создаётся при первом использовании
+        self._bulk_workers = bulk_workers or os.cpu_count() or 1
+        self._process_pool = None
+
+    async def run_db(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._db_executor, functools.partial(metrics.timed_operation, func, *args, **kwargs)
+        )
+
+    async def run_report(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._report_executor, functools.partial(metrics.timed_operation, func, *args, **kwargs)
+        )
+
+    async def run_qr(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._qr_executor, functools.partial(func, *args, **kwargs))
+
+    # --- Пользователи ---
+    async def get_user(self, user_id: int):
+        return await self.run_db(db.User.get_by, 'user_id', user_id)
+
+    async def find_user_by_name(self, full_name: str):
+        return await self.run_db(db.User.get_by, 'full_name', full_name)
+
+    async def search_users(self, query: str, limit: int = 10):
+        """Нечёткий поиск по ФИО: [(запись, оценка)] по убыванию оценки"""
+        return await self.run_db(db.User.search, query, limit)
+
+    async def create_user(self, user_id: int, full_name: str, vehicle: str = None):
+        return await self.run_db(db.User.create, user_id, full_name, vehicle)
+
+    async def get_all_users(self):
+        return await self.run_db(db.User.get_all)
+
+    async def generate_user_qr(self, user_id: int):
+        """Перевыпускает QR-код и возвращает обновлённую запись и PNG"""
+        user = await self.get_user(user_id)
+        if not user:
+            return None, None
+
+        payload = db.User.qr_payload(user)
+        qr_path = db.qr_disk_path(db.User.qr_path(user_id))
+        png = await self.run_qr(qr_service.get_png, user['qr_id'], payload, qr_path)
+        await self.update_user(user.doc_id, db.qr_fields(payload, qr_path))
+        return await self.get_user(user_id), png
+
+    async def get_users_without_qr(self):
+        users = await self.get_all_users()
+        return [u for u in users if not u.get('qr_payload') and not u.get('qr_code_path')]
+
+    async def find_users_by_names(self, names: list):
+        """Возвращает найденных пользователей и список ненайденных ФИО"""
+        users, missing = [], []
+        for name in names:
+            user = await self.find_user_by_name(name)
+            if user:
+                users.append(user)
+            else:
+                missing.append(name)
+        return users, missing
+
+    async def bulk_generate_user_qr(self, users: list, missing: list = ()):
+        """Рисует QR-коды на всех ядрах, записывает их одной пачкой
+        и возвращает ZIP-архивы (каждый влезает в лимит Telegram) и сводку"""
+        loop = asyncio.get_running_loop()
+        if self._process_pool is None:
+            # spawn, а не fork: дочерний процесс не должен унаследовать блокировки,
+            # захваченные потоками БД и QR. Процессы импортируют только qr_images
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self._bulk_workers, mp_context=multiprocessing.get_context('spawn')
+            )
+
+        payloads = [db.User.qr_payload(user) for user in users]
+        pngs = await asyncio.gather(*(
+            loop.run_in_executor(self._process_pool, qr_images.render_png, payload)
+            for payload in payloads
+        ))
+
+        updates, files = {}, {}
+        for user, payload, png in zip(users, payloads, pngs):
+            qr_path = db.qr_disk_path(db.User.qr_path(user['user_id']))
+            updates[user.doc_id] = db.qr_fields(payload, qr_path)
+            files[f"{qr_service.safe_filename(user['full_name'])}_{user['qr_id']}.png"] = png
+            qr_service.cache.put(qr_service.QRCache.key(user['qr_id'], payload), png)
+            if qr_path:
+                await self.run_qr(qr_service.save_png, qr_path, png)
+        await self.run_db(db.User.update_many, updates)
+
+        summary = f"Выпущено QR-кодов: {len(users)}\nДата: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+        if missing:
+            summary += "\nНе найдены:\n" + "\n".join(missing) + "\n"
+        archives = await self.run_qr(qr_service.build_zips, files, summary)
+        return archives, summary
+
+    async def get_qr_png(self, record):
+        return await self.run_qr(
+            qr_service.get_png, record['qr_id'], record.get('qr_payload'), record.get('qr_code_path')
+        )
+
+    async def update_user(self, doc_id: int, data: dict):
+        await self.run_db(db.User.update, doc_id, data)
+
+    # --- Сотрудники и гости ---
+    ROSTERS = {'users': db.User, 'employees': db.Employee}
+
+    async def import_roster(self, kind: str, path: str):
+        """Разбор CSV и вставка одной пачкой; возвращает (добавлено, ошибки по строкам)"""
+        return await self.run_db(self.ROSTERS[kind].import_csv, path)
+
+    async def export_roster(self, kind: str, path: str) -> int:
+        if db.DB_BACKEND == 'sqlite':
+            # SQLite читается страницами — выгрузка не держит поток БД
+            return await self.run_report(self.ROSTERS[kind].export_csv, path)
+        return await self.run_db(self.ROSTERS[kind].export_csv, path)
+
+    async def search_employees(self, query: str, limit: int = 10):
+        return await self.run_db(db.Employee.search, query, limit)
+
+    async def get_employee(self, doc_id: int):
+        return await self.run_db(db.Employee.get_by_id, doc_id)
+
+    async def toggle_employee_status(self, doc_id: int):
+        await self.run_db(db.Employee.toggle_status, doc_id)
+
+    async def toggle_guest_status(self, doc_id: int):
+        await self.run_db(db.Guest.toggle_status, doc_id)
+
+    async def get_all_guests(self):
+        return await self.run_db(db.Guest.get_all)
+
+    async def get_guest(self, doc_id: int):
+        return await self.run_db(db.Guest.get_by_id, doc_id)
+
+    async def get_guest_by_qr(self, qr_id: int):
+        return await self.run_db(db.Guest.get_by, 'qr_id', qr_id)
+
+    async def update_guest(self, doc_id: int, data: dict):
+        await self.run_db(db.Guest.update, doc_id, data)
+
+    async def update_guests(self, updates: dict):
+        await self.run_db(db.Guest.update_many, updates)
+
+    async def create_temp_pass(self, days_valid: int):
+        """Создаёт гостевой пропуск и возвращает запись и PNG"""
+        doc_id, qr_id = await self.run_db(db.Guest.create, days_valid)
+        payload = db.Guest.qr_payload(await self.get_guest(doc_id))
+        qr_path = db.qr_disk_path(db.Guest.qr_path(doc_id))
+        png = await self.run_qr(qr_service.get_png, qr_id, payload, qr_path)
+        await self.update_guest(doc_id, db.qr_fields(payload, qr_path))
+        return await self.get_guest(doc_id), png
+
+    async def sync_revocations(self, max_age: float):
+        # Проверка срока в памяти, чтобы не ходить в поток БД на каждый скан
+        if db.PassRevocations.is_stale(max_age):
+            await self.run_db(db.PassRevocations.sync, max_age)
+
+    # --- Запросы на проход и журнал ---
+    async def create_pending_request(self, requester_id: int, pass_id: int, user_type: str,
+                                     expires_at: float = None, summary: str = None):
+        doc_id = await self.run_db(
+            db.PendingRequest.create, requester_id, pass_id, user_type, expires_at, summary
+        )
+        return await self.run_db(db.PendingRequest.get_by_id, doc_id)
+
+    async def update_pending_request(self, doc_id: int, data: dict):
+        await self.run_db(db.PendingRequest.update, doc_id, data)
+
+    async def update_pending_requests(self, updates: dict):
+        await self.run_db(db.PendingRequest.update_many, updates)
+
+    async def find_pending_by_pass_id(self, pass_id: int):
+        return await self.run_db(db.PendingRequest.find_by, 'pass_id', pass_id)
+
+    async def find_pending_by_message(self, message_id: int):
+        return await self.run_db(db.PendingRequest.find_by_message, message_id)
+
+    async def get_pending_request(self, doc_id: int):
+        return await self.run_db(db.PendingRequest.get_by_id, doc_id)
+
+    async def get_all_pending_requests(self):
+        return await self.run_db(db.PendingRequest.get_all)
+
+    async def remove_pending_request(self, doc_id: int) -> bool:
+        return await self.run_db(db.PendingRequest.remove, doc_id)
+
+    async def remove_pending_requests(self, doc_ids: list) -> list:
+        return await self.run_db(db.PendingRequest.remove_many, doc_ids)
+
+    async def log_access(self, user_type: str, user_id: int, status: str):
+        await self.run_db(db.AccessLog.log_entry, user_type, user_id, status)
+
+    async def log_access_many(self, entries: list):
+        await self.run_db(db.AccessLog.log_entries, entries)
+
+    async def get_recent_access_logs(self, count: int):
+        return await self.run_db(db.AccessLog.tail, count)
+
+    async def get_access_stats(self, start: str, end: str, period: str = 'day', **filters):
+        return await self.run_report(db.AccessLog.stats, start, end, period, **filters)
+
+    async def export_access_logs(self, path: str, start: str, end: str, **filters):
+        return await self.run_report(db.AccessLog.export_csv, path, start, end, **filters)
+
+    # --- Новости ---
+    async def create_news(self, title: str, content: str, media_type: str = None, media_id: str = None):
+        return await self.run_db(db.News.create, title, content, media_type, media_id)
+
+    async def get_latest_news(self):
+        return await self.run_db(db.News.latest)
+
+    async def get_news_page(self, before: int = None, after: int = None, size: int = 5):
+        return await self.run_db(db.News.page, before, after, size)
+
+    async def delete_all_news(self):
+        await self.run_db(db.News.truncate)
+
+    # --- Рассылки ---
+    async def create_broadcast(self, text: str, admin_chat_id: int, status_message_id: int, total: int):
+        doc_id = await self.run_db(db.Broadcast.create, text, admin_chat_id, status_message_id, total)
+        return await self.run_db(db.Broadcast.get_by_id, doc_id)
+
+    async def update_broadcast(self, doc_id: int, data: dict):
+        await self.run_db(db.Broadcast.update, doc_id, data)
+
+    async def get_unfinished_broadcasts(self):
+        return await self.run_db(db.Broadcast.get_unfinished)
+
+    # --- Обслуживание ---
+    async def compact(self, log_before: str, guests_before: datetime, pending_before: float):
+        """Архивирует старый журнал, удаляет мёртвые записи и ужимает файл БД"""
+        # Архивирование читает и сжимает сегменты — в потоке отчётов, не задерживая записи
+        archived = await self.run_report(db.AccessLog.archive, log_before)
+        pending = await self.run_db(db.PendingRequest.purge_dead, pending_before)
+        guests = await self.run_db(db.Guest.purge_expired, guests_before)
+        if db.DB_BACKEND == 'sqlite':
+            # У SQLite своё соединение для обслуживания — поток БД не занимаем
+            await self.run_report(db.compact)
+        else:
+            await self.run_db(db.compact)
+        return archived, pending, guests
+
+    async def flush(self):
+        await self.run_db(db.flush)
+
+    async def close(self):
+        await self.run_db(db.close)
+        self._qr_executor.shutdown(wait=True)
+        self._report_executor.shutdown(wait=True)
+        self._db_executor.shutdown(wait=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True)
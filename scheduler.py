@@ -0,0 +1,80 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import datetime
+
+import qr_service
+from pending import PendingRegistry
+from repository import Repository
+
+
+class GuestExpiryScheduler:
+    """Отключает гостевые пропуска точно в момент истечения срока.
+
+    Сроки активных пропусков лежат в куче; задача спит до ближайшего
+    и при пробуждении обрабатывает только истёкшие пропуска. Таблица
+    guests просматривается целиком один раз — при запуске."""
+
+    def __init__(self, repo: Repository, pending: PendingRegistry):
+        self.repo = repo
+        self.pending = pending
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        for guest in await self.repo.get_all_guests():
+            if guest['is_active']:
+                self.schedule(guest)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def schedule(self, guest):
+        expires_at = datetime.fromisoformat(guest['expires_at']).timestamp()
+        heapq.heappush(self._heap, (expires_at, guest.doc_id))
+        if self._heap[0][1] == guest.doc_id:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            expires_at, doc_id = self._heap[0]
+            delay = expires_at - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            try:
+                await self._expire(doc_id)
+            except Exception as e:
+                logging.error(f"Ошибка отключения гостевого пропуска {doc_id}: {e}")
+
+    async def _expire(self, doc_id: int):
+        guest = await self.repo.get_guest(doc_id)
+        if guest is None or not guest['is_active']:
+            return
+        # Пропуск могли продлить — тогда он уже стоит в куче с новым сроком
+        if datetime.fromisoformat(guest['expires_at']).timestamp() > time.time():
+            return
+
+        await self.repo.update_guest(doc_id, {'is_active': False})
+        qr_service.cache.discard(guest['qr_id'])
+        if guest.get('qr_code_path') and os.path.exists(guest['qr_code_path']):
+            await self.repo.run_qr(os.remove, guest['qr_code_path'])
+        # Запросы могли открыть и другие воркеры — берём их из БД
+        for request in await self.pending.fetch_by_pass_id(guest['qr_id']):
+            await self.pending.expire(request.doc_id)
+        logging.info(f"Гостевой пропуск {doc_id} истёк и отключён")
@@ -0,0 +1,212 @@
+import json
+import sqlite3
+import threading
+
+from tinydb.table import Document
+
+
+class SQLiteTable:
+    """Таблица в SQLite с тем же набором методов TinyDB.Table,
+    которым пользуются модели из database.py.
+    Документ хранится как JSON в колонке data, индексы строятся
+    по выражениям json_extract для полей из BaseModel.indexes"""
+
+    def __init__(self, database: 'SQLiteDatabase', name: str):
+        self._db = database
+        self.name = name
+        # SQL собираем один раз: sqlite3 кэширует подготовленные
+        # выражения по тексту запроса, поэтому они переиспользуются
+        quoted = f'"{name}"'
+        self._sql_insert = f'INSERT INTO {quoted} (data) VALUES (?)'
+        self._sql_insert_with_id = f'INSERT OR REPLACE INTO {quoted} (doc_id, data) VALUES (?, ?)'
+        self._sql_get = f'SELECT data FROM {quoted} WHERE doc_id = ?'
+        self._sql_update = f'UPDATE {quoted} SET data = ? WHERE doc_id = ?'
+        self._sql_remove = f'DELETE FROM {quoted} WHERE doc_id = ?'
+        self._sql_all = f'SELECT doc_id, data FROM {quoted} ORDER BY doc_id'
+        self._sql_all_after = f'SELECT doc_id, data FROM {quoted} WHERE doc_id > ? ORDER BY doc_id'
+        self._sql_page = f'{self._sql_all_after} LIMIT ?'
+        self._sql_truncate = f'DELETE FROM {quoted}'
+        self._sql_count = f'SELECT COUNT(*) FROM {quoted}'
+        self._sql_search = {}
+
+        with self._db.lock:
+            self._db.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {quoted} ('
+                'doc_id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'data TEXT NOT NULL)'
+            )
+
+    def create_indexes(self, fields):
+        with self._db.lock:
+            for field in fields:
+                expr = f"json_extract(data, '$.{field}')"
+                self._db.conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "ix_{self.name}_{field}" '
+                    f'ON "{self.name}" ({expr})'
+                )
+                self._sql_search[field] = (
+                    f'SELECT doc_id, data FROM "{self.name}" '
+                    f'WHERE {expr} = ? ORDER BY doc_id'
+                )
+
+    def search_by(self, field: str, value):
+        with self._db.lock:
+            rows = self._db.conn.execute(self._sql_search[field], (value,)).fetchall()
+        return [Document(json.loads(data), doc_id) for doc_id, data in rows]
+
+    def insert(self, document: dict) -> int:
+        with self._db.lock:
+            cursor = self._db.conn.execute(self._sql_insert, (json.dumps(document, ensure_ascii=False),))
+        return cursor.lastrowid
+
+    def insert_multiple(self, documents) -> list:
+        doc_ids = []
+        with self._db.lock, self._db.transaction():
+            for document in documents:
+                cursor = self._db.conn.execute(self._sql_insert, (json.dumps(document, ensure_ascii=False),))
+                doc_ids.append(cursor.lastrowid)
+        return doc_ids
+
+    def import_documents(self, documents: dict):
+        """Вставка документов с сохранением их doc_id (для миграции)"""
+        rows = [(int(doc_id), json.dumps(doc, ensure_ascii=False)) for doc_id, doc in documents.items()]
+        with self._db.lock, self._db.transaction():
+            self._db.conn.executemany(self._sql_insert_with_id, rows)
+
+    def get(self, doc_id: int = None):
+        with self._db.lock:
+            row = self._db.conn.execute(self._sql_get, (doc_id,)).fetchone()
+        if row is None:
+            return None
+        return Document(json.loads(row[0]), doc_id)
+
+    def update(self, fields: dict, doc_ids):
+        with self._db.lock, self._db.transaction():
+            for doc_id in doc_ids:
+                row = self._db.conn.execute(self._sql_get, (doc_id,)).fetchone()
+                if row is None:
+                    continue
+                doc = json.loads(row[0])
+                doc.update(fields)
+                self._db.conn.execute(self._sql_update, (json.dumps(doc, ensure_ascii=False), doc_id))
+
+    def update_many(self, updates: dict):
+        """{doc_id: fields} — все обновления в одной транзакции"""
+        with self._db.lock, self._db.transaction():
+            for doc_id, fields in updates.items():
+                self.update(fields, [doc_id])
+
+    def remove(self, doc_ids) -> list:
+        """Удаляет документы и, как TinyDB, возвращает doc_id реально удалённых"""
+        removed = []
+        with self._db.lock, self._db.transaction():
+            for doc_id in doc_ids:
+                if self._db.conn.execute(self._sql_remove, (doc_id,)).rowcount:
+                    removed.append(doc_id)
+        return removed
+
+    def all(self):
+        with self._db.lock:
+            rows = self._db.conn.execute(self._sql_all).fetchall()
+        return [Document(json.loads(data), doc_id) for doc_id, data in rows]
+
+    def all_after(self, doc_id: int):
+        """Записи, добавленные после doc_id (в том числе другими процессами)"""
+        with self._db.lock:
+            rows = self._db.conn.execute(self._sql_all_after, (doc_id,)).fetchall()
+        return [Document(json.loads(data), doc_id) for doc_id, data in rows]
+
+    def iter_all(self, page: int = 1000):
+        """Все документы по порядку страницами: блокировка берётся на страницу,
+        и остальные запросы к БД проходят между ними"""
+        last = 0
+        while True:
+            with self._db.lock:
+                rows = self._db.conn.execute(self._sql_page, (last, page)).fetchall()
+            for doc_id, data in rows:
+                yield Document(json.loads(data), doc_id)
+            if len(rows) < page:
+                return
+            last = rows[-1][0]
+
+    def truncate(self):
+        with self._db.lock:
+            self._db.conn.execute(self._sql_truncate)
+
+    def __len__(self):
+        with self._db.lock:
+            return self._db.conn.execute(self._sql_count).fetchone()[0]
+
+
+class SQLiteDatabase:
+    """Замена TinyDB: db.table(name) возвращает SQLiteTable"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        # isolation_level=None — автокоммит, транзакции открываем явно
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        # Действует только для нового файла (до создания таблиц): тогда vacuum()
+        # освобождает пустые страницы без переписывания всей БД
+        self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self._tables = {}
+        self._in_transaction = False
+
+    def table(self, name: str) -> SQLiteTable:
+        if name not in self._tables:
+            self._tables[name] = SQLiteTable(self, name)
+        return self._tables[name]
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def data_version(self) -> int:
+        """Меняется, когда файл изменило другое соединение (другой процесс)"""
+        with self.lock:
+            return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def vacuum(self):
+        """Возвращает системе место после удаления записей.
+
+        Полный VACUUM переписывает весь файл и всё это время держит
+        блокировку, поэтому только освобождаем пустые страницы
+        (incremental_vacuum) и обрезаем WAL. Работает на своём соединении,
+        так что поток БД и другие процессы ждут не дольше этих шагов"""
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                # execute() делает лишь один шаг (одну страницу), executescript — все
+                conn.executescript('PRAGMA incremental_vacuum;')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        finally:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class _Transaction:
+    # Вложенные транзакции сливаются во внешнюю
+    def __init__(self, database: SQLiteDatabase):
+        self._db = database
+        self._outer = False
+
+    def __enter__(self):
+        if not self._db._in_transaction:
+            self._db.conn.execute('BEGIN IMMEDIATE')
+            self._db._in_transaction = True
+            self._outer = True
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._outer:
+            return False
+        self._db._in_transaction = False
+        if exc_type is None:
+            self._db.conn.execute('COMMIT')
+        else:
+            self._db.conn.execute('ROLLBACK')
+        return False
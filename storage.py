@@ -0,0 +1,91 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+from tinydb.storages import Storage
+
+
+class BufferedJSONStorage(Storage):
+    """Хранилище TinyDB, которое держит все таблицы в памяти
+    и сбрасывает их в файл пачками, а не на каждую операцию"""
+
+    def __init__(self, path: str, flush_interval: float = 2.0, flush_ops: int = 50,
+                 encoding: str = 'utf-8'):
+        self._path = path
+        self._encoding = encoding
+        self._flush_interval = flush_interval
+        self._flush_ops = flush_ops
+        self._lock = threading.RLock()
+
+        self._data = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, encoding=encoding) as f:
+                self._data = json.load(f)
+
+        # Сериализованные таблицы: имя -> (объект таблицы, json)
+        # TinyDB при каждой записи подменяет словарь изменённой таблицы,
+        # поэтому по идентичности объекта видно, какие таблицы "грязные"
+        self._fragments = {}
+        self._pending_ops = 0
+        self._last_flush = time.monotonic()
+        self._closed = False
+        atexit.register(self.close)
+
+    def read(self):
+        return self._data
+
+    def write(self, data):
+        with self._lock:
+            self._data = data
+            self._pending_ops += 1
+            if (self._pending_ops >= self._flush_ops
+                    or time.monotonic() - self._last_flush >= self._flush_interval):
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending_ops or self._data is None:
+                self._last_flush = time.monotonic()
+                return
+
+            parts = []
+            for name, table in self._data.items():
+                cached = self._fragments.get(name)
+                if cached is None or cached[0] is not table:
+                    cached = (table, json.dumps(table, ensure_ascii=False))
+                    self._fragments[name] = cached
+                parts.append(f'{json.dumps(name, ensure_ascii=False)}: {cached[1]}')
+            for name in set(self._fragments) - set(self._data):
+                del self._fragments[name]
+
+            self._replace_file('{' + ', '.join(parts) + '}')
+            self._pending_ops = 0
+            self._last_flush = time.monotonic()
+
+    def compact(self):
+        """Переписывает файл целиком, даже если изменений не было"""
+        with self._lock:
+            if self._data is None:
+                return
+            self._fragments.clear()
+            self._pending_ops += 1
+            self.flush()
+
+    def _replace_file(self, content: str):
+        # Пишем во временный файл и атомарно подменяем им db.json,
+        # чтобы падение посреди записи не оставило битый файл
+        tmp_path = f'{self._path}.tmp'
+        with open(tmp_path, 'w', encoding=self._encoding) as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self.flush()
+            self._closed = True
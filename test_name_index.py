@@ -0,0 +1,46 @@
+import itertools
+
+from name_index import NameIndex, normalize
+
+SURNAMES = ['Иванов', 'Петров', 'Волков', 'Фёдоров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов']
+FIRST_NAMES = ['Иван', 'Пётр', 'Сергей', 'Алексей']
+PATRONYMICS = ['Иванович', 'Петрович', 'Сергеевич']
+
+
+def build_index(copies: int = 20) -> NameIndex:
+    # Много однофамильцев и ещё больше людей с теми же именем и отчеством
+    index = NameIndex()
+    names = itertools.product(SURNAMES, FIRST_NAMES, PATRONYMICS, range(copies))
+    for doc_id, (surname, first, patronymic, _) in enumerate(names, 1):
+        index.add(doc_id, f'{surname} {first} {patronymic}')
+    return index
+
+
+def test_exact_name_ranks_first_among_common_names():
+    index = build_index()
+    for query in ('Иванов Иван Иванович', 'Федоров Петр Петрович', 'Волков Сергей Петрович'):
+        results = index.search(query, limit=5)
+        assert len(results) == 5
+        for doc_id, score in results:
+            assert index.name(doc_id) == normalize(query)
+            assert score == 1.0
+
+
+def test_typo_and_yo_find_the_name():
+    index = build_index(copies=1)
+    doc_id, _ = index.search('федоров пётр петровичь', limit=1)[0]
+    assert index.name(doc_id) == 'федоров петр петрович'
+    doc_id, _ = index.search('Кузнецоф Алексей', limit=1)[0]
+    assert index.name(doc_id).startswith('кузнецов алексей')
+
+
+def test_rename_and_remove():
+    index = NameIndex()
+    index.add(1, 'Иванов Иван Иванович')
+    index.add(2, 'Иванов Иван Иванович')
+    index.add(1, 'Петров Пётр Петрович')
+    assert [doc_id for doc_id, _ in index.search('Иванов Иван Иванович')] == [2]
+    assert index.search('Петров Петр Петрович')[0] == (1, 1.0)
+    index.remove(2)
+    assert index.search('Иванов Иван Иванович') == []
+    assert len(index) == 1
@@ -0,0 +1,41 @@
+import pytest
+
+import pass_token
+from pass_token import InvalidPass
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setenv('QR_SECRET', 'test-secret')
+    monkeypatch.setattr(pass_token, 'revoked', set())
+
+
+def reason(payload: str) -> str:
+    with pytest.raises(InvalidPass) as error:
+        pass_token.verify(payload)
+    return error.value.reason
+
+
+def test_signed_pass_round_trip():
+    payload = pass_token.sign(pass_token.USER, 123)
+    assert pass_token.verify(payload) == (pass_token.USER, 123, None)
+    assert reason(payload[:-1] + ('A' if payload[-1] != 'A' else 'B')) == 'signature'
+
+
+@pytest.mark.parametrize('payload', [
+    '', '123', 'P1.U.1.0', 'P1.X.1.0.sig', 'P2.U.1.0.sig', 'P1.U.abc.0.sig', 'P1.U.1.!.sig',
+    'P1.U.1.0.sig.extra',
+])
+def test_malformed_pass(payload):
+    assert reason(payload) == 'format'
+
+
+@pytest.mark.parametrize('payload', ['P1.U.1.0.ёё', 'P1.U.١.0.sig', 'P1.G.1.0.подпись'])
+def test_non_ascii_pass(payload):
+    assert reason(payload) == 'format'
+
+
+def test_revoked_pass():
+    payload = pass_token.sign(pass_token.GUEST, 7)
+    pass_token.set_revoked(pass_token.GUEST, 7, True)
+    assert reason(payload) == 'revoked'
@@ -0,0 +1,109 @@
+import math
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+import metrics
+
+
+def parse_limits(spec: str) -> dict:
+    """'scan_pass=5/60,reg=3/60' -> {'scan_pass': (5, 60.0), 'reg': (3, 60.0)}:
+    не больше N вызовов подряд, дальше — по одному раз в период / N секунд.
+    Ключ * задаёт лимит для остальных команд"""
+    limits = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        command, limit = item.split('=')
+        burst, period = limit.split('/')
+        limits[command.strip().lstrip('/')] = (int(burst), float(period))
+    return limits
+
+
+def command_name(message) -> str:
+    """Команда сообщения без / и @имя_бота. Фото здесь не считаются: сканом
+    его делают фильтры обработчика (личный чат, нет состояния FSM), а их
+    можно проверить только после FSM — такие фото ограничивает сам обработчик"""
+    if message.text and message.text.startswith('/'):
+        return message.text.split(maxsplit=1)[0][1:].split('@')[0].lower()
+    return None
+
+
+class TokenBuckets:
+    """Корзины токенов по (пользователь, команда) в LRU-словаре на max_size
+    записей: память ограничена при любом числе пользователей. Вытесненная
+    корзина при следующем обращении начинается полной"""
+
+    def __init__(self, limits: dict, max_size: int = 100_000):
+        self.limits = limits
+        self.max_size = max_size
+        # (user_id, команда) -> [токены, время обновления, предупреждён ли]
+        self._buckets = OrderedDict()
+
+    def limit_for(self, command: str):
+        return self.limits.get(command) or self.limits.get('*')
+
+    def consume(self, user_id: int, command: str):
+        """0, если вызов разрешён, иначе сколько секунд ждать следующего токена
+        и первый ли это отказ подряд (о нём стоит сказать пользователю)"""
+        limit = self.limit_for(command)
+        if limit is None:
+            return 0, False
+        burst, period = limit
+        rate = burst / period
+        now = time.monotonic()
+        key = (user_id, command)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(burst), now, False]
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return 0, False
+        first_refusal = not bucket[2]
+        bucket[2] = True
+        return (1 - bucket[0]) / rate, first_refusal
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update, который стоит раньше FSM: лишние
+    вызовы отбрасываются до чтения состояния и обращений к БД.
+    О превышении лимита пользователь узнаёт один раз, остальные
+    сообщения молча пропускаются"""
+
+    def __init__(self, buckets: TokenBuckets):
+        self.buckets = buckets
+
+    async def __call__(self, handler, event: Update, data):
+        message = event.message
+        if message is None or message.from_user is None:
+            return await handler(event, data)
+        command = command_name(message)
+        if command is None or await self.allow(message, command):
+            return await handler(event, data)
+        return None
+
+    async def allow(self, message, command: str) -> bool:
+        """Списывает вызов command; при превышении лимита один раз предупреждает"""
+        wait, first_refusal = self.buckets.consume(message.from_user.id, command)
+        if not wait:
+            return True
+
+        metrics.THROTTLED.inc(command)
+        if first_refusal:
+            await message.bot.send_message(
+                message.chat.id, f"⏳ Слишком часто. Повторите через {math.ceil(wait)} с"
+            )
+        return False
@@ -0,0 +1,103 @@
+"""Приём обновлений через вебхук вместо long polling.
+
+Telegram шлёт обновления POST-запросами на WEBHOOK_PATH с заголовком
+X-Telegram-Bot-Api-Secret-Token. Сервер отвечает сразу, а обработка
+идёт в фоне на воркерах из workers.py с ограниченными очередями.
+
+Для локальной проверки можно отправить записанные обновления
+(JSON по одному на строку) на запущенный сервер:
+
+    python webhook.py updates.jsonl http://127.0.0.1:8080/webhook --secret $WEBHOOK_SECRET
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+
+from aiogram import Bot
+from aiogram.types import Update
+from aiohttp import ClientSession, web
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """aiohttp-приложение, которое принимает обновления и отдаёт их воркерам
+    (UpdateWorkers или ProcessWorkers из workers.py).
+
+    Очереди воркеров ограничены: если очередь полна, Telegram получает 503
+    и повторит доставку позже, поэтому память не растёт при наплыве.
+    При остановке сервер перестаёт принимать запросы, воркеры дорабатывают
+    очереди и только потом вызывается shutdown бота."""
+
+    def __init__(self, bot: Bot, workers, secret_token: str, path: str = '/webhook',
+                 url: str = None, allowed_updates=None):
+        if not secret_token:
+            raise ValueError('Для режима вебхука нужен WEBHOOK_SECRET')
+        self.bot = bot
+        self.workers = workers
+        self.secret_token = secret_token
+        self.path = path
+        self.url = url
+        self.allowed_updates = allowed_updates
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    def run(self, host: str = '0.0.0.0', port: int = 8080):
+        # run_app сам ловит SIGINT/SIGTERM и вызывает on_shutdown
+        web.run_app(self.create_app(), host=host, port=port, print=None)
+
+    async def _on_startup(self, app):
+        await self.workers.start()
+        if self.url:
+            await self.bot.set_webhook(
+                url=self.url.rstrip('/') + self.path,
+                secret_token=self.secret_token,
+                allowed_updates=self.allowed_updates
+            )
+            logging.info(f"Вебхук установлен на {self.url.rstrip('/') + self.path}")
+
+    async def _on_shutdown(self, app):
+        await self.workers.stop()
+        await self.bot.session.close()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception as e:
+            logging.error(f"Не удалось разобрать обновление: {e}")
+            return web.Response(status=400)
+
+        if not self.workers.submit_nowait(update):
+            return web.Response(status=503)
+        return web.Response()
+
+
+async def replay(path: str, url: str, secret_token: str):
+    """Отправляет записанные обновления на локальный сервер"""
+    async with ClientSession() as session:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                async with session.post(url, json=json.loads(line),
+                                        headers={SECRET_HEADER: secret_token}) as response:
+                    print(response.status)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Отправка записанных обновлений на вебхук')
+    parser.add_argument('updates', help='файл с обновлениями, по одному JSON на строку')
+    parser.add_argument('url', help='адрес вебхука, например http://127.0.0.1:8080/webhook')
+    parser.add_argument('--secret', required=True, help='значение WEBHOOK_SECRET')
+    args = parser.parse_args()
+    asyncio.run(replay(args.updates, args.url, args.secret))
@@ -0,0 +1,199 @@
+"""Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+UpdateWorkers — несколько задач asyncio внутри одного процесса.
+ProcessWorkers — BOT_WORKERS процессов, в каждом свой Dispatcher из app.py,
+чтобы отрисовка QR и сериализация JSON занимали несколько ядер.
+
+В обоих случаях обновление попадает к исполнителю по from_user.id: шаги
+одного пользователя (например, /reg) обрабатываются строго по очереди,
+а разные пользователи — параллельно. Процессы делят только SQLite
+(DB_BACKEND=sqlite), журнал проходов и файл состояний FSM."""
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+
+def update_owner(update: Update) -> int:
+    """Чьё это обновление: по нему выбирается исполнитель"""
+    user = getattr(update.event, 'from_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(update.event, 'chat', None)
+    return chat.id if chat is not None else update.update_id
+
+
+class UpdateWorkers:
+    """Задачи asyncio с собственными ограниченными очередями"""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = 8, queue_size: int = 100,
+                 drain_timeout: float = 30):
+        self.dp = dp
+        self.bot = bot
+        self.drain_timeout = drain_timeout
+        self._queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._tasks = []
+
+    def _queue_for(self, update: Update) -> asyncio.Queue:
+        return self._queues[update_owner(update) % len(self._queues)]
+
+    async def start(self):
+        await self.dp.emit_startup(bot=self.bot)
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    def submit_nowait(self, update: Update) -> bool:
+        """False, если очередь исполнителя заполнена"""
+        try:
+            self._queue_for(update).put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def submit(self, update: Update):
+        await self._queue_for(update).put(update)
+
+    async def stop(self):
+        """Дорабатывает очереди и вызывает shutdown бота"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), self.drain_timeout)
+        except asyncio.TimeoutError:
+            left = sum(q.qsize() for q in self._queues)
+            logging.warning(f"Не дождались обработки {left} обновлений при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.dp.emit_shutdown(bot=self.bot)
+
+    async def _worker(self, updates: asyncio.Queue):
+        while True:
+            update = await updates.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logging.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                updates.task_done()
+
+
+class ProcessWorkers:
+    """Процессы-воркеры. Обновления передаются им как JSON через
+    ограниченные очереди multiprocessing; упавший процесс перезапускается
+    при следующем обновлении для него"""
+
+    def __init__(self, workers: int, tasks: int = 8, queue_size: int = 100, drain_timeout: float = 30):
+        self.workers = workers
+        self.tasks = tasks
+        self.queue_size = queue_size
+        self.drain_timeout = drain_timeout
+        # spawn, а не fork: открытые соединения SQLite нельзя переносить в дочерний процесс
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._processes = [None] * workers
+
+    def _spawn(self, index: int):
+        # Номер воркера дочерний процесс читает из окружения при импорте app.py
+        os.environ['BOT_WORKER_INDEX'] = str(index)
+        process = self._context.Process(
+            target=_worker_process,
+            args=(self._queues[index], self.tasks, self.queue_size, self.drain_timeout),
+            name=f'bot-worker-{index}'
+        )
+        process.start()
+        self._processes[index] = process
+
+    async def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        os.environ.pop('BOT_WORKER_INDEX', None)
+
+    def _index_for(self, update: Update) -> int:
+        index = update_owner(update) % self.workers
+        if not self._processes[index].is_alive():
+            logging.error(f"Воркер {index} завершился (код {self._processes[index].exitcode}), перезапускаем")
+            self._spawn(index)
+        return index
+
+    def submit_nowait(self, update: Update) -> bool:
+        data = update.model_dump_json(exclude_unset=True, by_alias=True)
+        try:
+            self._queues[self._index_for(update)].put_nowait(data)
+        except queue.Full:
+            return False
+        return True
+
+    async def submit(self, update: Update):
+        loop = asyncio.get_running_loop()
+        data = update.model_dump_json(exclude_unset=True, by_alias=True)
+        await loop.run_in_executor(None, self._queues[self._index_for(update)].put, data)
+
+    async def stop(self):
+        loop = asyncio.get_running_loop()
+        for updates in self._queues:
+            await loop.run_in_executor(None, updates.put, None)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, self.drain_timeout + 10)
+            if process.is_alive():
+                logging.warning(f"Воркер {process.name} не остановился, завершаем принудительно")
+                process.terminate()
+
+
+def _worker_process(updates, tasks: int, queue_size: int, drain_timeout: float):
+    # Ctrl+C получает вся группа процессов; останавливает воркер главный процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # main.py при spawn ничего не создаёт — бот и соединения с БД появляются здесь
+    module = importlib.import_module('app')
+    asyncio.run(_serve(module.dp, module.bot, updates, tasks, queue_size, drain_timeout))
+
+
+async def _serve(dp: Dispatcher, bot: Bot, updates, tasks: int, queue_size: int, drain_timeout: float):
+    local = UpdateWorkers(dp, bot, workers=tasks, queue_size=queue_size, drain_timeout=drain_timeout)
+    await local.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await local.submit(Update.model_validate_json(data, context={'bot': bot}))
+    finally:
+        await local.stop()
+        await bot.session.close()
+
+
+async def poll(bot: Bot, workers, allowed_updates=None):
+    """Long polling, который только раздаёт обновления воркерам"""
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.error(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await workers.submit(update)
+            offset = update.update_id + 1
+
+
+def run_polling(bot: Bot, workers, allowed_updates=None):
+    async def run():
+        loop = asyncio.get_running_loop()
+        await workers.start()
+        task = asyncio.create_task(poll(bot, workers, allowed_updates))
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, task.cancel)
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await workers.stop()
+            await bot.session.close()
+
+    asyncio.run(run())